@@ -0,0 +1,232 @@
+"""
+Backtests the cheap-flight detection of flights-updateOnStream over an
+exported price history (see export.py), for a grid of parameters:
+
+    python analytics/backtest.py DATASET [--percentiles 1,5 2,10] [--limits 15 30]
+                                 [--history-days 0 90] [--json]
+
+Every snapshot is replayed in collection order per route and checked the
+way the stream handler does in history mode: once a route has at least
+limit prices, a price below the first percentile of its history (new price
+included) alerts with the highest level, below the second with the next
+one, and so on. Alerts are deduplicated per route, dates and price bucket
+like AlertStore does, ignoring expiry. Days skipped by delta writes are
+replayed as copies of the route's previous snapshot: they join the history
+windows, but are never checked, as they fired no stream event.
+
+All snapshots of a chunk of routes are evaluated at once: the expanding
+history windows are sorted once per --history-days value, after which
+every percentile is a gather and every parameter set a few comparisons.
+"""
+import argparse
+import itertools
+import json
+import math
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from export import read_columns  # noqa: E402
+from flights_common.snapshots import daily_weights  # noqa: E402
+
+# the stream handler's parameters
+PERCENTILES = [1, 5]
+PRICE_NUMBER_LIMIT = 15
+GAMMA = 1.02
+# cells of the sorted windows evaluated at once, ~64 MB of float64
+CHUNK_CELLS = 8 * 10 ** 6
+
+
+def levels_for(percentiles):
+    """Levels of the thresholds, highest for the lowest percentile, [2, 1] for two."""
+    return list(range(len(percentiles), 0, -1))
+
+
+class Routes:
+    """
+    Snapshots of a dataset ordered by route and collection date, with one
+    snapshot per collected day: days skipped by delta writes are filled in
+    as carried copies of the route's previous snapshot, counted by
+    flights_common.snapshots.daily_weights.
+    """
+
+    def __init__(self, columns):
+        order = np.lexsort((columns['collection_date'], columns['flight_id']))
+        flight_ids = columns['flight_id'][order]
+        collected = columns['collection_date'][order].astype('datetime64[D]')
+        previous = columns['previous_date'][order].astype('datetime64[D]')
+        dates = collected.astype(np.int64)
+        weights = daily_weights(flight_ids, collected, previous)
+        rows = np.repeat(np.arange(len(order)), weights)
+        offsets = np.arange(len(rows)) - np.repeat(np.cumsum(weights) - weights, weights)
+        self.carried = offsets > 0
+        self.flight_ids = flight_ids[rows]
+        self.prices = columns['price'][order][rows].astype(np.float64)
+        self.dates = dates[rows] + offsets
+        self.departures = columns['departure_date'][order][rows].astype('datetime64[D]').astype(np.int64)
+        self.returns = columns['return_date'][order][rows].astype('datetime64[D]').astype(np.int64)
+        _, self.starts, self.counts = np.unique(self.flight_ids, return_index=True, return_counts=True)
+
+    def __len__(self):
+        return len(self.prices)
+
+    def chunks(self):
+        """
+        Yields routes of similar length together, padded to a matrix.
+        :return: Generator of (index, prices, dates) arrays of shape
+                 (routes, snapshots); padding has index -1 and NaN price.
+        """
+        by_length = np.argsort(-self.counts, kind='stable')
+        start = 0
+        while start < len(by_length):
+            # the first route of a chunk is its longest
+            width = int(self.counts[by_length[start]])
+            size = max(1, CHUNK_CELLS // width ** 2)
+            routes = by_length[start:start + size]
+            start += size
+            positions = np.arange(width)
+            index = self.starts[routes][:, None] + positions
+            index[positions >= self.counts[routes][:, None]] = -1
+            yield index, np.where(index >= 0, self.prices[index], np.nan), np.where(index >= 0, self.dates[index], 0)
+
+
+def sorted_windows(prices, dates, history_days):
+    """
+    Sorts the price history every snapshot is compared against: the route's
+    prices collected up to and including it, within history_days if set.
+    :return: Sorted windows of shape (routes, snapshots, snapshots), padded
+             with inf, and their sizes of shape (routes, snapshots).
+    """
+    width = prices.shape[1]
+    valid = np.tri(width, dtype=bool)[None] & ~np.isnan(prices)[:, None, :]
+    if history_days:
+        valid &= dates[:, None, :] >= dates[:, :, None] - history_days
+    windows = np.where(valid, prices[:, None, :], np.inf)
+    windows.sort(axis=-1)
+    return windows, valid.sum(axis=-1)
+
+
+def window_percentile(windows, sizes, q):
+    """Percentile q of every window, interpolated like np.percentile."""
+    rank = np.maximum(sizes - 1, 0) * (q / 100)
+    lower = np.floor(rank).astype(np.int64)
+    upper = np.ceil(rank).astype(np.int64)
+    lower_values = np.take_along_axis(windows, lower[..., None], axis=-1)[..., 0]
+    upper_values = np.take_along_axis(windows, upper[..., None], axis=-1)[..., 0]
+    return lower_values + (upper_values - lower_values) * (rank - lower)
+
+
+def backtest(routes, grid):
+    """
+    Evaluates all parameter sets over all snapshots.
+    :param routes: Routes of the dataset.
+    :param grid: Parameter sets, dicts of percentiles, limit and history_days.
+    :return: Alert level (0 for none) of every snapshot per parameter set,
+             the median at every snapshot per history_days, and the share
+             of all the route's prices, past and future, below every snapshot.
+    """
+    levels = {i: np.zeros(len(routes), dtype=np.int8) for i in range(len(grid))}
+    medians = {}
+    hindsight = np.zeros(len(routes))
+    for n, history_days in enumerate(sorted({params['history_days'] for params in grid})):
+        median = medians[history_days] = np.zeros(len(routes))
+        wanted = {q for params in grid if params['history_days'] == history_days for q in params['percentiles']}
+        for index, prices, dates in routes.chunks():
+            found = index >= 0
+            windows, sizes = sorted_windows(prices, dates, history_days)
+            values = {q: window_percentile(windows, sizes, q) for q in wanted}
+            median[index[found]] = window_percentile(windows, sizes, 50)[found]
+            if n == 0:
+                # NaN padding compares as False
+                below = (prices[:, None, :] < prices[:, :, None]).sum(axis=-1)
+                hindsight[index[found]] = (below / found.sum(axis=1)[:, None])[found]
+            for i, params in enumerate(grid):
+                if params['history_days'] != history_days:
+                    continue
+                level = np.zeros(prices.shape, dtype=np.int8)
+                # the first threshold below the price decides, as in check_flight
+                for q, value in reversed(list(zip(params['percentiles'], levels_for(params['percentiles'])))):
+                    level[prices < values[q]] = value
+                level[sizes < params['limit']] = 0
+                levels[i][index[found]] = level[found]
+    for level in levels.values():
+        level[routes.carried] = 0
+    return levels, medians, hindsight
+
+
+def summarize(routes, params, level, median, hindsight):
+    """Alert counts and price quality of one parameter set."""
+    alerted = np.flatnonzero(level)
+    route_index = np.searchsorted(routes.starts, alerted, side='right') - 1
+    if len(alerted):
+        # AlertStore keys: route, dates and price bucket
+        buckets = np.ceil(np.log(np.maximum(routes.prices[alerted], 1.0)) / math.log(GAMMA)).astype(np.int64)
+        keys = np.stack([route_index, routes.departures[alerted], routes.returns[alerted], buckets], axis=1)
+        first = np.sort(np.unique(keys, axis=0, return_index=True)[1])
+        alerted, route_index = alerted[first], route_index[first]
+    days = int(routes.dates.max() - routes.dates.min() + 1) if len(routes) else 0
+    return {
+        **params,
+        'alerts': int(len(alerted)),
+        'alerts_by_level': {
+            str(value): int((level[alerted] == value).sum()) for value in levels_for(params['percentiles'])
+        },
+        'routes_alerted': int(len(np.unique(route_index))),
+        'alerts_per_day': len(alerted) / days if days else 0.0,
+        # how far below the median at the time the alerted prices were
+        'mean_discount': float((1 - routes.prices[alerted] / median[alerted]).mean()) if len(alerted) else None,
+        # share of the route's prices, past and future, below the alerted ones
+        'mean_rank': float(hindsight[alerted].mean()) if len(alerted) else None,
+        'cheapest_5pct': float((hindsight[alerted] <= 0.05).mean()) if len(alerted) else None,
+    }
+
+
+def parse_percentiles(text):
+    percentiles = sorted(float(p) for p in text.split(','))
+    return [int(p) if p.is_integer() else p for p in percentiles]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dataset', type=Path)
+    parser.add_argument('--percentiles', nargs='+', type=parse_percentiles,
+                        default=[PERCENTILES], help='Comma separated threshold percentiles, e.g. 1,5')
+    parser.add_argument('--limits', nargs='+', type=int, default=[PRICE_NUMBER_LIMIT])
+    parser.add_argument('--history-days', nargs='+', type=int, default=[0], help='0 for the full history')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    routes = Routes(read_columns(args.dataset))
+    loaded = time.perf_counter()
+    grid = [
+        {'percentiles': percentiles, 'limit': limit, 'history_days': history_days}
+        for percentiles, limit, history_days in itertools.product(args.percentiles, args.limits, args.history_days)
+    ]
+    levels, medians, hindsight = backtest(routes, grid)
+    results = [
+        summarize(routes, params, levels[i], medians[params['history_days']], hindsight)
+        for i, params in enumerate(grid)
+    ]
+    elapsed = time.perf_counter() - loaded
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{len(routes)} snapshots of {len(routes.starts)} routes, {len(grid)} parameter sets: '
+          f'loaded in {loaded - start:.2f} s, evaluated in {elapsed:.2f} s')
+    print(f"{'percentiles':<14}{'limit':>6}{'days':>6}{'alerts':>8}{'by level':>14}{'routes':>8}"
+          f"{'discount':>10}{'rank':>7}{'top 5%':>8}")
+    for result in results:
+        by_level = '/'.join(str(count) for count in result['alerts_by_level'].values())
+        quality = [result['mean_discount'], result['mean_rank'], result['cheapest_5pct']]
+        discount, rank, top = ('-' if value is None else f'{value:.1%}' for value in quality)
+        print(f"{','.join(map(str, result['percentiles'])):<14}{result['limit']:>6}{result['history_days']:>6}"
+              f"{result['alerts']:>8}{by_level:>14}{result['routes_alerted']:>8}"
+              f"{discount:>10}{rank:>7}{top:>8}")
+
+
+if __name__ == '__main__':
+    main()
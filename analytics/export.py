@@ -0,0 +1,259 @@
+"""
+Exports the price snapshots of the flights table into a local columnar
+dataset, partitioned by origin and collection date:
+
+    OUT/origin=KTW/collection_date=2026-10-18/part-<n>.parquet
+
+    python analytics/export.py OUT [--segments 8] [--format parquet|arrow|npz]
+    python analytics/export.py OUT --from-export DIR
+
+Snapshots are read with a parallel Scan of the table or, with --from-export,
+from the DynamoDB JSON files of a table export. Runs are incremental: only
+the last exported collection date and newer ones are read, and the last
+date's partitions are replaced, as snapshots may have been added to it
+since. --full replaces every partition the source has rows for. Partitions
+a run read no rows for are left as they are. Parquet and Arrow files need
+pyarrow; without it the columns are written as .npz files.
+
+Snapshots written by delta writes keep the collection date of the route's
+previous snapshot as previous_date; the days in between had its price.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'flights-common' / 'python'))
+try:
+    import pyarrow as pa
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+ROWS_PER_FILE = 100000
+FIELDS = ['FlightID', 'SortKey', 'departure_date', 'return_date', 'price', 'days', 'previous_cid']
+# column -> numpy dtype; dates are stored as days, partition columns live in the path
+COLUMNS = {
+    'flight_id': str,
+    'destination': str,
+    'trip_type': str,
+    'departure_date': 'datetime64[D]',
+    'return_date': 'datetime64[D]',
+    'price': np.float64,
+    'days': np.int16,
+    # NaT for snapshots written every day
+    'previous_date': 'datetime64[D]',
+}
+EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow', 'npz': '.npz'}
+
+
+def iso_date(date):
+    """YYYYMMDD -> YYYY-MM-DD, which numpy parses as datetime64."""
+    return f'{date[:4]}-{date[4:6]}-{date[6:8]}'
+
+
+def last_exported(out_dir):
+    """
+    :return: Newest collection date (YYYYMMDD) in the dataset or None.
+    """
+    dates = [
+        path.name.split('=', 1)[1]
+        for path in Path(out_dir).glob('origin=*/collection_date=*')
+        if any(path.iterdir())
+    ]
+    return max(dates).replace('-', '') if dates else None
+
+
+def existing_parts(out_dir, collection_date=None):
+    """
+    :param collection_date: Optional collection date (YYYYMMDD) to limit the files to.
+    :return: Data files already in the dataset, all or those of one date.
+    """
+    partition = f'collection_date={iso_date(collection_date)}' if collection_date else 'collection_date=*'
+    return list(Path(out_dir).glob(f'origin=*/{partition}/part-*'))
+
+
+def table_items(since=None, segments=8):
+    """
+    Reads snapshots with a parallel Scan of the flights table.
+    :param since: Optional collection date (YYYYMMDD); only snapshots of it
+                  and newer ones are read.
+    """
+    import boto3
+    from boto3.dynamodb.conditions import Attr
+    from flights_common.table import FlightsTable
+
+    table = FlightsTable(boto3.resource('dynamodb'))
+    if not table.exists():
+        raise SystemExit(f'Table {table.table_name} does not exist')
+    if since:
+        condition = Attr('SortKey').gte(f'cid_{since}') & Attr('SortKey').begins_with('cid_')
+    else:
+        condition = Attr('SortKey').begins_with('cid_')
+    return table.scan_items(segments=segments, projection=FIELDS, filter_expression=condition)
+
+
+def export_items(export_dir, since=None):
+    """
+    Reads snapshots from the data files of a DynamoDB table export
+    (DYNAMODB_JSON format, optionally gzipped).
+    :param since: Optional collection date (YYYYMMDD); only snapshots of it
+                  and newer ones are read.
+    """
+    from boto3.dynamodb.types import TypeDeserializer
+
+    deserializer = TypeDeserializer()
+    paths = sorted(Path(export_dir).rglob('*.json.gz')) + sorted(Path(export_dir).rglob('*.json'))
+    for path in paths:
+        opener = gzip.open if path.suffix == '.gz' else open
+        with opener(path, 'rt') as lines:
+            for line in lines:
+                image = json.loads(line)['Item']
+                sort_key = image['SortKey']['S']
+                if not sort_key.startswith('cid_') or (since and sort_key < f'cid_{since}'):
+                    continue
+                yield {name: deserializer.deserialize(image[name]) for name in FIELDS if name in image}
+
+
+class PartitionWriter:
+    """
+    Buffers rows per (origin, collection date) partition and writes them as
+    typed column files once a partition holds rows_per_file rows, so the
+    table is never held in memory as a whole.
+    """
+
+    def __init__(self, out_dir, file_format='parquet', rows_per_file=ROWS_PER_FILE):
+        if file_format != 'npz' and pa is None:
+            raise SystemExit(f'Writing {file_format} files needs pyarrow, use --format npz')
+        self.out_dir = Path(out_dir)
+        self.file_format = file_format
+        self.rows_per_file = rows_per_file
+        self.partitions = defaultdict(lambda: {name: [] for name in COLUMNS})
+        self.rows = 0
+        self.files = 0
+        self.paths = set()
+        self.run = time.strftime('%Y%m%d%H%M%S')
+
+    def add(self, item):
+        origin, destination, trip_type = item['FlightID'].split('-')
+        collection_date = iso_date(item['SortKey'][4:])
+        columns = self.partitions[origin, collection_date]
+        columns['flight_id'].append(item['FlightID'])
+        columns['destination'].append(destination)
+        columns['trip_type'].append(trip_type)
+        columns['departure_date'].append(iso_date(item['departure_date']))
+        columns['return_date'].append(iso_date(item['return_date']))
+        columns['price'].append(float(item['price']))
+        columns['days'].append(int(item['days']))
+        previous_cid = item.get('previous_cid')
+        columns['previous_date'].append(iso_date(previous_cid[4:]) if previous_cid else 'NaT')
+        self.rows += 1
+        if len(columns['price']) >= self.rows_per_file:
+            self.write(origin, collection_date)
+
+    def write(self, origin, collection_date):
+        columns = self.partitions.pop((origin, collection_date))
+        arrays = {name: np.array(values, dtype=COLUMNS[name]) for name, values in columns.items()}
+        directory = self.out_dir / f'origin={origin}' / f'collection_date={collection_date}'
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'part-{self.run}-{self.files}{EXTENSIONS[self.file_format]}'
+        # written under a temporary name, so readers never see partial files
+        partial = path.with_name(path.name + '.tmp')
+        if self.file_format == 'npz':
+            with open(partial, 'wb') as file:
+                np.savez(file, **arrays)
+        else:
+            table = pa.table({
+                name: pa.array(array, type=pa.date32()) if array.dtype.kind == 'M' else pa.array(array)
+                for name, array in arrays.items()
+            })
+            if self.file_format == 'parquet':
+                pyarrow.parquet.write_table(table, partial, compression='zstd')
+            else:
+                pyarrow.feather.write_feather(table, partial, compression='zstd')
+        os.replace(partial, path)
+        self.paths.add(path)
+        self.files += 1
+
+    def close(self):
+        for origin, collection_date in list(self.partitions):
+            self.write(origin, collection_date)
+
+
+def read_columns(out_dir):
+    """
+    Loads the whole dataset back as numpy columns, including the origin and
+    collection_date partition columns.
+    :return: Mapping of column name to array, rows in no particular order.
+    """
+    parts = defaultdict(list)
+    for path in sorted(Path(out_dir).glob('origin=*/collection_date=*/part-*')):
+        if path.suffix not in EXTENSIONS.values():
+            continue
+        if path.suffix == '.npz':
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        else:
+            if pa is None:
+                raise SystemExit(f'Reading {path.name} needs pyarrow')
+            read = pyarrow.parquet.read_table if path.suffix == '.parquet' else pyarrow.feather.read_table
+            table = read(path)
+            arrays = {
+                name: column.to_numpy().astype(COLUMNS[name]) if name in COLUMNS else column.to_numpy()
+                for name, column in zip(table.column_names, table.columns)
+            }
+        rows = len(arrays['price'])
+        if 'previous_date' not in arrays:
+            # exported before delta writes
+            arrays['previous_date'] = np.full(rows, 'NaT', dtype='datetime64[D]')
+        origin = path.parent.parent.name.split('=', 1)[1]
+        collection_date = path.parent.name.split('=', 1)[1]
+        arrays['origin'] = np.full(rows, origin)
+        arrays['collection_date'] = np.full(rows, collection_date, dtype='datetime64[D]')
+        for name, array in arrays.items():
+            parts[name].append(array)
+    return {name: np.concatenate(arrays) for name, arrays in parts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('out', type=Path)
+    parser.add_argument('--from-export', type=Path, help='Directory of a DynamoDB table export')
+    parser.add_argument('--segments', type=int, default=8, help='Parallel scan segments')
+    parser.add_argument('--format', choices=list(EXTENSIONS), default='parquet' if pa is not None else 'npz')
+    parser.add_argument('--rows-per-file', type=int, default=ROWS_PER_FILE)
+    parser.add_argument('--full', action='store_true', help='Export everything, not only new collections')
+    args = parser.parse_args()
+
+    since = None if args.full else last_exported(args.out)
+    # replaced once the new files are written, so readers never see the partitions empty
+    replaced = existing_parts(args.out, since) if args.full or since else []
+    if args.from_export:
+        items = export_items(args.from_export, since)
+    else:
+        items = table_items(since, args.segments)
+    start = time.perf_counter()
+    writer = PartitionWriter(args.out, args.format, args.rows_per_file)
+    for item in items:
+        writer.add(item)
+    writer.close()
+    # partitions the source had no rows for keep their files
+    rewritten = {path.parent for path in writer.paths}
+    # a run within the same second writes over its predecessor's file names
+    replaced = [path for path in replaced if path.parent in rewritten and path not in writer.paths]
+    for path in replaced:
+        path.unlink()
+    since_text = f'from cid_{since}' if since else 'from the start'
+    print(f'Exported {writer.rows} snapshots {since_text} into {writer.files} files, replacing {len(replaced)} '
+          f'in {time.perf_counter() - start:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
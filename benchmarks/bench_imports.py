@@ -0,0 +1,72 @@
+"""
+Measures the import (cold start) cost of both lambda modules with
+python -X importtime, in a fresh interpreter per sample.
+
+    python benchmarks/bench_imports.py [--repeat 5] [--top 15]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+MODULES = ['flights-download.lambda_function', 'flights-updateOnStream.lambda_function']
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def sample(module):
+    """
+    Imports the module in a new interpreter.
+    :return: Mapping of top-level package to its own import time, and the
+             total import time of the module, in microseconds.
+    """
+    env = {
+        **os.environ,
+        'AWS_DEFAULT_REGION': os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'),
+        # stands in for the flights-common layer on the lambda sys.path
+        'PYTHONPATH': str(ROOT / 'flights-common' / 'python'),
+    }
+    # __import__ goes through the C import path, which -X importtime reports on
+    code = f'import time; start = time.perf_counter(); __import__({module!r}); print(time.perf_counter() - start)'
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    packages = defaultdict(int)
+    total = 0
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        packages[name.split('.')[0]] += int(self_us)
+    total = float(result.stdout.strip()) * 1e6
+    return packages, total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    for module in MODULES:
+        samples = [sample(module) for _ in range(args.repeat)]
+        totals = [total for _, total in samples]
+        packages = defaultdict(list)
+        for sampled, _ in samples:
+            for name, us in sampled.items():
+                packages[name].append(us)
+        print(f'\n{module}: median {statistics.median(totals) / 1000:.1f} ms '
+              f'(min {min(totals) / 1000:.1f} ms over {args.repeat} runs)')
+        heaviest = sorted(packages.items(), key=lambda item: -statistics.median(item[1]))[:args.top]
+        for name, us in heaviest:
+            print(f'  {name:<32}{statistics.median(us) / 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
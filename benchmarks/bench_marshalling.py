@@ -0,0 +1,75 @@
+"""
+Microbenchmark of the DynamoDB item conversion on a batch of flight items.
+
+    python benchmarks/bench_marshalling.py [--items 3000] [--repeat 20]
+"""
+import argparse
+import importlib
+import json
+import random
+import sys
+import timeit
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'flights-common' / 'python'))
+marshalling = importlib.import_module('flights_common.marshalling')
+
+
+def make_items(n, seed=0):
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        key = f'KTW-A{i % 700:03d}-{rng.choice(["BREAK", "WEEK", "LONG"])}'
+        items.append({
+            'FlightID': key,
+            'SortKey': 'details',
+            'origin_place_id': 'KTW',
+            'destination_place_id': key[4:8],
+            'destination_city': 'City',
+            'destination_country': 'Country',
+            'latitude': round(rng.uniform(-60, 75), 5),
+            'longitude': round(rng.uniform(-180, 180), 5),
+        })
+        items.append({
+            'FlightID': key,
+            'SortKey': 'cid_20261018',
+            'collection_date': '2026-10-18',
+            'departure_date': '20261105',
+            'return_date': '20261109',
+            'price': float(rng.randrange(150, 4000)),
+            'days': rng.randrange(2, 14),
+        })
+    return items
+
+
+def json_roundtrip(item):
+    return json.loads(json.dumps(item), parse_float=Decimal)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    items = make_items(args.items // 2)
+    converters = {
+        'json round trip': json_roundtrip,
+        'direct': marshalling.make_converter(),
+        'direct, cached': marshalling.make_converter(cache_size=4096),
+    }
+    expected = [json_roundtrip(item) for item in items]
+    for name, convert in converters.items():
+        assert [convert(item) for item in items] == expected, name
+
+    baseline = None
+    for name, convert in converters.items():
+        seconds = min(timeit.repeat(lambda: [convert(item) for item in items], number=1, repeat=args.repeat))
+        baseline = baseline or seconds
+        print(f'{name:<16} {seconds * 1000:8.2f} ms / {len(items)} items  x{baseline / seconds:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Kayak exploreapi fixtures and DynamoDB Stream records for the replay
+benchmarks. Recorded responses can be dropped into a fixtures directory as
+<origin>_<days range>.json, e.g. KTW_2-4.json; synthetic ones are
+generated in the same layout.
+"""
+import gzip
+import hashlib
+import io
+import json
+import random
+import datetime as dt
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from boto3.dynamodb.types import TypeSerializer
+
+DAYS_RANGES = ['2,4', '5,8', '9,13']
+
+
+def fixture_name(origin, days_range):
+    return f"{origin}_{days_range.replace(',', '-')}.json"
+
+
+def airport_code(i):
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    return letters[i // 676 % 26] + letters[i // 26 % 26] + letters[i % 26]
+
+
+def make_destinations(origin, days_range, n, seed=0):
+    """Synthetic exploreapi/destinations response with n destinations."""
+    rng = random.Random(f'{origin}-{days_range}-{seed}')
+    min_days, max_days = map(int, days_range.split(','))
+    destinations = []
+    for i in range(n):
+        code = airport_code(i)
+        place = random.Random(code)
+        departure = dt.date(2026, 11, 1) + dt.timedelta(days=rng.randrange(120))
+        days = rng.randint(min_days, max_days)
+        destinations.append({
+            'originAirportShortName': origin,
+            'airport': {
+                'shortName': code,
+                'latitude': round(place.uniform(-50, 70), 5),
+                'longitude': round(place.uniform(-120, 150), 5),
+            },
+            'city': {'name': f'City {code}'},
+            'country': {'name': f'Country {i % 60}'},
+            'departd': departure.strftime('%Y%m%d'),
+            'returnd': (departure + dt.timedelta(days=days)).strftime('%Y%m%d'),
+            'days': days,
+            'flightInfo': {'price': rng.randrange(150, 5000)},
+        })
+    return {'destinations': destinations}
+
+
+def write_fixtures(directory, origins, n, seed=0):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for origin in origins:
+        for days_range in DAYS_RANGES:
+            path = directory / fixture_name(origin, days_range)
+            path.write_text(json.dumps(make_destinations(origin, days_range, n, seed)))
+    return directory
+
+
+def drift_fixtures(directory, run, change_rate):
+    """
+    Gives about change_rate of the destinations of every fixture a new
+    price, as between two daily collections.
+    :param run: Number of the collection, so every run changes other destinations.
+    """
+    for path in Path(directory).glob('*.json'):
+        response = json.loads(path.read_text())
+        for destination in response['destinations']:
+            rng = random.Random(f"{path.stem}-{destination['airport']['shortName']}-{run}")
+            if rng.random() < change_rate:
+                destination['flightInfo']['price'] = rng.randrange(150, 5000)
+        path.write_text(json.dumps(response))
+
+
+class FixtureAdapter(BaseAdapter):
+    """Serves exploreapi requests from a fixtures directory, revalidating by ETag."""
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = Path(directory)
+
+    def send(self, request, **kwargs):
+        query = parse_qs(urlsplit(request.url).query)
+        path = self.directory / fixture_name(query['airport'][0], query['tripdurationrange'][0])
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.headers = CaseInsensitiveDict({'Content-Type': 'application/json'})
+        if path.exists():
+            body = path.read_bytes()
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            response.headers['ETag'] = etag
+            if request.headers.get('If-None-Match') == etag:
+                response.status_code = 304
+                response.raw = io.BytesIO(b'')
+            else:
+                response.status_code = 200
+                response.raw = io.BytesIO(body)
+        else:
+            response.status_code = 404
+            response.raw = io.BytesIO(b'{"destinations": []}')
+        return response
+
+    def close(self):
+        pass
+
+
+def make_history(n_routes, history_days, today, seed=0):
+    """
+    Synthetic table contents: details, total_agg and one snapshot per day
+    for each route. total_agg is left without a price sketch.
+    :return: Items per route, keyed by FlightID.
+    """
+    rng = random.Random(seed)
+    routes = {}
+    for i in range(n_routes):
+        code = airport_code(i)
+        trip_type = ['BREAK', 'WEEK', 'LONG'][i % 3]
+        flight_id = f'KTW-{code}-{trip_type}'
+        base_price = rng.randrange(200, 3000)
+        items = [
+            {
+                'FlightID': flight_id, 'SortKey': 'details', 'origin_place_id': 'KTW',
+                'destination_place_id': code, 'destination_city': f'City {code}',
+                'destination_country': f'Country {i % 60}'
+            },
+            {'FlightID': flight_id, 'SortKey': 'total_agg', 'count_total': 0, 'price_total': 0},
+        ]
+        for day in range(history_days, -1, -1):
+            date = today - dt.timedelta(days=day)
+            departure = date + dt.timedelta(days=rng.randrange(14, 120))
+            days = rng.randint(2, 13)
+            items.append({
+                'FlightID': flight_id,
+                'SortKey': f"cid_{date.strftime('%Y%m%d')}",
+                'collection_date': date.isoformat(),
+                'departure_date': departure.strftime('%Y%m%d'),
+                'return_date': (departure + dt.timedelta(days=days)).strftime('%Y%m%d'),
+                'price': max(int(rng.gauss(base_price, base_price * 0.2)), 50),
+                'days': days,
+            })
+        routes[flight_id] = items
+    return routes
+
+
+def stream_record(item, event_name='INSERT'):
+    serializer = TypeSerializer()
+    return {
+        'eventName': event_name,
+        'dynamodb': {
+            'Keys': {key: serializer.serialize(item[key]) for key in ('FlightID', 'SortKey')},
+            'NewImage': {key: serializer.serialize(value) for key, value in item.items()},
+        }
+    }
+
+
+def write_export(directory, routes, files=4):
+    """
+    Writes routes made by make_history like the data files of a DynamoDB
+    table export in DYNAMODB_JSON format.
+    """
+    serializer = TypeSerializer()
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    items = [item for items in routes.values() for item in items]
+    for n in range(files):
+        with gzip.open(directory / f'{n:04d}.json.gz', 'wt') as file:
+            for item in items[n::files]:
+                image = {key: serializer.serialize(value) for key, value in item.items()}
+                file.write(json.dumps({'Item': image}) + '\n')
+    return directory
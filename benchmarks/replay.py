@@ -0,0 +1,284 @@
+"""
+Offline replay benchmark of both Lambdas against an in-process DynamoDB
+stand-in, reporting throughput, per-stage latency and consumed capacity.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/replay.py download [--fixtures DIR] [--origins KTW KRK] [--destinations 400] [--stream]
+                                         [--write-mode delta] [--change-rate 0.2]
+    python benchmarks/replay.py stream [--routes 200] [--history-days 90] [--stats-mode sketch]
+    python benchmarks/replay.py baseline [--routes 200] [--history-days 90] [--seasonality month]
+
+Both accept --runs, --trace-memory, --throttle-rate (share of DynamoDB requests failed with
+ProvisionedThroughputExceededException), --unprocessed-rate (share of batch puts returned as
+UnprocessedItems) and --json.
+"""
+import argparse
+import datetime as dt
+import functools
+import importlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'flights-common' / 'python'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fixtures import FixtureAdapter, drift_fixtures, make_history, stream_record, write_fixtures  # noqa: E402
+from standin import CapacityMeter, create_flights_table, start_dynamodb  # noqa: E402
+
+
+class StageTimer:
+    """Records the latency of every call to the wrapped functions."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def wrap(self, owner, name, stage=None):
+        func = getattr(owner, name)
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.samples[stage or name].append(time.perf_counter() - start)
+
+        setattr(owner, name, timed)
+
+    def reset(self):
+        self.samples.clear()
+
+    def summary(self):
+        return {
+            stage: {
+                'calls': len(samples),
+                'total_ms': sum(samples) * 1000,
+                'mean_ms': sum(samples) / len(samples) * 1000,
+                'max_ms': max(samples) * 1000,
+            }
+            for stage, samples in self.samples.items()
+        }
+
+
+def load_lambda(package, meter, create_table=True):
+    """Imports a lambda package against the stand-in and creates its table."""
+    module = importlib.import_module(f'{package}.lambda_function')
+    logging.getLogger().setLevel(logging.WARNING)
+    meter.attach(module.dyn_resource.meta.client)
+    if create_table:
+        create_flights_table(module.dyn_resource)
+    return module
+
+
+def seed_history(dyn_resource, args):
+    """
+    Writes the synthetic history of args.routes routes.
+    :return: The newest snapshot of every route.
+    """
+    sketch = importlib.import_module('flights-updateOnStream.sketch')
+    routes = make_history(args.routes, args.history_days, dt.date.today())
+    dynamo_table = dyn_resource.Table('flights')
+    new_items = []
+    with dynamo_table.batch_writer() as writer:
+        for items in routes.values():
+            *history, new_item = items
+            if args.warm_sketch:
+                price_sketch = sketch.PriceSketch()
+                prices = [item['price'] for item in history if item['SortKey'].startswith('cid_')]
+                for price in prices:
+                    price_sketch.add(price)
+                history[1].update({
+                    'count_total': len(prices), 'price_total': sum(prices),
+                    'price_hist': price_sketch.to_item(), 'last_cid': history[-1]['SortKey']
+                })
+            for item in history + [new_item]:
+                writer.put_item(Item=item)
+            new_items.append(new_item)
+    return new_items
+
+
+def run(handler, event, timer, meter, trace_memory=False):
+    timer.reset()
+    meter.reset()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        response, error = handler(event, None), None
+    except Exception as err:
+        response, error = None, f'{type(err).__name__}: {err}'
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return {
+        'seconds': seconds,
+        'peak_mb': peak,
+        'response': response,
+        'error': error,
+        'stages': timer.summary(),
+        'dynamodb': meter.summary(),
+    }
+
+
+def replay_download(args, meter, timer):
+    module = load_lambda('flights-download', meter)
+    fetch = importlib.import_module('flights-download.fetch')
+    table = importlib.import_module('flights_common.table')
+    utils = importlib.import_module('flights-download.utils')
+    origins = list(utils.origin_coordinates_map) if args.origins == ['all'] else args.origins
+    fixtures = args.fixtures or write_fixtures(
+        tempfile.mkdtemp(prefix='kayak-'), origins, args.destinations
+    )
+    fetch.SESSION.mount('https://', FixtureAdapter(fixtures))
+    timer.wrap(module, 'fetch_trips')
+    timer.wrap(module, 'parse_trip')
+    timer.wrap(table.FlightsTable, 'write_batch')
+    timer.wrap(table.FlightsTable, 'batch_get_items')
+
+    meter.throttle_rate = args.throttle_rate
+    meter.unprocessed_rate = args.unprocessed_rate
+    results = []
+    collection_for = module.collection_for
+    for day in range(args.runs):
+        # every run collects the next day, with change_rate of the prices moved
+        module.collection_for = lambda date, days=dt.timedelta(days=day): collection_for(date + days)
+        if day and args.change_rate:
+            drift_fixtures(fixtures, day, args.change_rate)
+        event = {'origins': 'all' if args.origins == ['all'] else origins, 'stream': args.stream}
+        result = run(module.lambda_handler, event, timer, meter, args.trace_memory)
+        if result['response']:
+            body = json.loads(result['response']['body'])
+            result['items'] = body.get('written', 0)
+            result['unchanged'] = body.get('unchanged', 0)
+        results.append(result)
+    return results
+
+
+def replay_stream(args, meter, timer):
+    module = load_lambda('flights-updateOnStream', meter)
+    table = importlib.import_module('flights_common.table')
+    new_items = seed_history(module.dyn_resource, args)
+    if args.stats_mode == 'baseline':
+        load_lambda('flights-baseline', meter, create_table=False).lambda_handler({}, None)
+
+    sent = []
+    module.send_email = lambda flights: sent.append(len(flights))
+    for name in ('history_stats', 'sketch_stats', 'load_baselines'):
+        if hasattr(module, name):
+            timer.wrap(module, name)
+    timer.wrap(table.FlightsTable, 'query_items')
+    timer.wrap(table.FlightsTable, 'get_item')
+    if hasattr(table.FlightsTable, 'update_price_stats'):
+        timer.wrap(table.FlightsTable, 'update_price_stats')
+
+    records = [stream_record(item) for item in new_items]
+    batches = [records[i:i + args.batch_size] for i in range(0, len(records), args.batch_size)]
+    meter.throttle_rate = args.throttle_rate
+    meter.unprocessed_rate = args.unprocessed_rate
+    results = []
+    for _ in range(args.runs):
+        for batch in batches:
+            result = run(module.lambda_handler, {'Records': batch}, timer, meter, args.trace_memory)
+            result['items'] = len(batch)
+            results.append(result)
+    return results
+
+
+def replay_baseline(args, meter, timer):
+    module = load_lambda('flights-baseline', meter)
+    baseline = importlib.import_module('flights-baseline.baseline')
+    seed_history(module.dyn_resource, args)
+    timer.wrap(module, 'scan_prices')
+    timer.wrap(baseline, 'group_percentiles')
+    timer.wrap(module.FlightsTable, 'batch_put_items')
+
+    meter.throttle_rate = args.throttle_rate
+    meter.unprocessed_rate = args.unprocessed_rate
+    results = []
+    for _ in range(args.runs):
+        result = run(module.lambda_handler, {}, timer, meter, args.trace_memory)
+        if result['response']:
+            result['items'] = json.loads(result['response']['body']).get('snapshots', 0)
+        results.append(result)
+    return results
+
+
+def print_report(mode, results):
+    for i, result in enumerate(results, 1):
+        rate = result.get('items', 0) / result['seconds'] if result['seconds'] else 0
+        status = result['error'] or 'ok'
+        print(f"\n{mode} run {i}: {result['seconds']:.3f} s, {result.get('items', 0)} items "
+              f"({rate:.0f} items/s) - {status}")
+        if result['peak_mb'] is not None:
+            print(f"  peak traced memory: {result['peak_mb']:.1f} MiB")
+        if result.get('unchanged'):
+            print(f"  unchanged snapshots skipped: {result['unchanged']}")
+        print(f"  {'stage':<22}{'calls':>7}{'total ms':>11}{'mean ms':>10}{'max ms':>10}")
+        for stage, stats in result['stages'].items():
+            print(f"  {stage:<22}{stats['calls']:>7}{stats['total_ms']:>11.1f}"
+                  f"{stats['mean_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+        print(f"  {'dynamodb':<22}{'requests':>9}{'throttled':>10}{'unproc.':>9}{'RCU':>9}{'WCU':>9}")
+        for operation, stats in result['dynamodb'].items():
+            print(f"  {operation:<22}{stats['requests']:>9}{stats['throttled']:>10}{stats['unprocessed']:>9}"
+                  f"{stats['read_units']:>9.1f}{stats['write_units']:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=['download', 'stream', 'baseline'])
+    parser.add_argument('--runs', type=int, default=1)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--unprocessed-rate', type=float, default=0.0)
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--trace-memory', action='store_true', help='Report peak Python memory (slow)')
+    parser.add_argument('--fixtures', type=Path)
+    parser.add_argument('--origins', nargs='+', default=['KTW'], help="Origin codes or 'all'")
+    parser.add_argument('--destinations', type=int, default=400)
+    parser.add_argument('--stream', action='store_true', help='Parse Kayak responses incrementally')
+    parser.add_argument('--write-mode', choices=['full', 'delta'], default='full')
+    parser.add_argument('--change-rate', type=float, default=0.0,
+                        help='Share of prices changed between two download runs')
+    parser.add_argument('--http-cache-ttl', type=int,
+                        help='Cache Kayak responses for this many seconds, 0 to always revalidate')
+    parser.add_argument('--routes', type=int, default=200)
+    parser.add_argument('--history-days', type=int, default=90)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--stats-mode', choices=['sketch', 'history', 'baseline'], default='sketch')
+    parser.add_argument('--seasonality', default='', help="Seasons of baselines, e.g. 'month,weekday'")
+    parser.add_argument('--warm-sketch', action='store_true',
+                        help='Pre-build price sketches instead of seeding them from history on first use')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='flights-bench-')
+    os.environ['AIRPORT_CACHE_PATH'] = os.path.join(workdir, 'airports.db')
+    if args.http_cache_ttl is None:
+        os.environ['HTTP_CACHE_DIR'] = ''
+    else:
+        os.environ['HTTP_CACHE_DIR'] = os.path.join(workdir, 'http-cache')
+        os.environ['HTTP_CACHE_TTL'] = str(args.http_cache_ttl)
+    os.environ['WRITE_MODE'] = args.write_mode
+    os.environ['STATS_MODE'] = args.stats_mode
+    os.environ['SEASONALITY'] = args.seasonality
+    os.environ['BASELINE_SEASONALITY'] = args.seasonality.split(',')[0]
+    start_dynamodb()
+    meter, timer = CapacityMeter(), StageTimer()
+    replay = {'download': replay_download, 'stream': replay_stream, 'baseline': replay_baseline}[args.mode]
+    results = replay(args, meter, timer)
+    if args.json:
+        print(json.dumps(results, indent=2, default=str))
+    else:
+        print_report(args.mode, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+In-process DynamoDB stand-in for the benchmarks: moto serves the API and
+CapacityMeter hooks into the boto3 client to count requests, estimate
+consumed capacity and inject throttling errors.
+"""
+import json
+import math
+import os
+import random
+import threading
+from collections import Counter
+from types import SimpleNamespace
+
+READ_OPERATIONS = {'GetItem', 'BatchGetItem', 'Query', 'Scan'}
+WRITE_OPERATIONS = {'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem'}
+
+
+def start_dynamodb(region='us-east-1'):
+    """Starts the moto mock. Must run before the lambda modules are imported."""
+    os.environ.setdefault('AWS_DEFAULT_REGION', region)
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    try:
+        from moto import mock_aws
+    except ImportError:
+        from moto import mock_dynamodb as mock_aws
+    mock = mock_aws()
+    mock.start()
+    return mock
+
+
+def create_flights_table(dyn_resource, table_name='flights'):
+    table = dyn_resource.create_table(
+        TableName=table_name,
+        KeySchema=[
+            {'AttributeName': 'FlightID', 'KeyType': 'HASH'},
+            {'AttributeName': 'SortKey', 'KeyType': 'RANGE'},
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'FlightID', 'AttributeType': 'S'},
+            {'AttributeName': 'SortKey', 'AttributeType': 'S'},
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table.wait_until_exists()
+    return table
+
+
+def item_size(item):
+    return len(json.dumps(item, default=str))
+
+
+def read_units(size):
+    # eventually consistent reads: 0.5 RCU per started 4 KB
+    return max(math.ceil(size / 4096), 1) * 0.5
+
+
+def write_units(size):
+    return max(math.ceil(size / 1024), 1)
+
+
+class CapacityMeter:
+    """
+    Counts DynamoDB requests made through a boto3 client and estimates the
+    read and write units they would consume, from item sizes the way
+    DynamoDB bills them. Optionally fails a share of requests with
+    ProvisionedThroughputExceededException before they reach the stand-in,
+    and returns a share of BatchWriteItem puts as UnprocessedItems.
+    """
+
+    def __init__(self, throttle_rate=0.0, unprocessed_rate=0.0, seed=0):
+        self.throttle_rate = throttle_rate
+        self.unprocessed_rate = unprocessed_rate
+        self.rng = random.Random(seed)
+        self.pending = threading.local()
+        self.reset()
+
+    def reset(self):
+        self.requests = Counter()
+        self.throttles = Counter()
+        self.unprocessed = Counter()
+        self.read_units = Counter()
+        self.write_units = Counter()
+
+    def attach(self, client):
+        client.meta.events.register('before-call.dynamodb', self._before_call)
+        # ahead of the resource's deserializer, which has to see held back puts as sent
+        client.meta.events.register_first('after-call.dynamodb', self._after_call)
+
+    def _before_call(self, model, params, **kwargs):
+        operation = model.name
+        self.requests[operation] += 1
+        if operation in READ_OPERATIONS | WRITE_OPERATIONS and self.rng.random() < self.throttle_rate:
+            self.throttles[operation] += 1
+            error = {
+                'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Simulated throttle'},
+                'ResponseMetadata': {'HTTPStatusCode': 400},
+            }
+            return SimpleNamespace(status_code=400, headers={}), error
+        if operation in WRITE_OPERATIONS:
+            body = json.loads(params.get('body') or b'{}')
+            if operation == 'BatchWriteItem' and self.unprocessed_rate:
+                self.pending.unprocessed = self._hold_back(body)
+                params['body'] = json.dumps(body).encode()
+            if operation == 'BatchWriteItem':
+                sizes = [
+                    item_size(request['PutRequest']['Item'])
+                    for requests in body['RequestItems'].values()
+                    for request in requests if 'PutRequest' in request
+                ]
+            else:
+                sizes = [item_size(body.get('Item') or body.get('Key'))]
+            self.write_units[operation] += sum(write_units(size) for size in sizes)
+        return None
+
+    def _hold_back(self, body):
+        """Removes a share of the puts from a BatchWriteItem body."""
+        held = {}
+        for table, requests in body['RequestItems'].items():
+            kept = [request for request in requests if self.rng.random() >= self.unprocessed_rate]
+            if not kept:
+                kept = requests[:1]
+            if len(kept) < len(requests):
+                held[table] = [request for request in requests if request not in kept]
+                self.unprocessed['BatchWriteItem'] += len(held[table])
+            body['RequestItems'][table] = kept
+        return held
+
+    def _after_call(self, http_response, parsed, model, **kwargs):
+        operation = model.name
+        held = getattr(self.pending, 'unprocessed', None)
+        if operation == 'BatchWriteItem' and held:
+            parsed['UnprocessedItems'] = held
+            self.pending.unprocessed = None
+        if http_response.status_code >= 300 or operation not in READ_OPERATIONS:
+            return
+        if operation == 'GetItem':
+            units = read_units(item_size(parsed.get('Item', {})))
+        elif operation == 'BatchGetItem':
+            items = [item for items in parsed.get('Responses', {}).values() for item in items]
+            units = sum(read_units(item_size(item)) for item in items) or 0.5
+        else:
+            units = read_units(sum(item_size(item) for item in parsed.get('Items', [])))
+        self.read_units[operation] += units
+
+    def summary(self):
+        operations = sorted(set(self.requests) | set(self.throttles))
+        return {
+            operation: {
+                'requests': self.requests[operation],
+                'throttled': self.throttles[operation],
+                'unprocessed': self.unprocessed[operation],
+                'read_units': self.read_units[operation],
+                'write_units': self.write_units[operation],
+            }
+            for operation in operations
+        }
@@ -0,0 +1,157 @@
+import numpy as np
+from flights_common.baselines import SEASON_SIZES
+from flights_common.snapshots import daily_weights
+
+SEASONS = {
+    # numbered like flights_common.baselines.season_number, from departure days since epoch
+    'month': lambda days: days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) % 12,
+    # 1970-01-01 was a Thursday
+    'weekday': lambda days: (days + 3) % 7,
+}
+
+
+class PriceColumns:
+    """
+    Prices of all snapshots collected by a table scan, as columns. Routes are
+    stored as integer codes, so grouping needs no string comparisons.
+    """
+
+    def __init__(self, since=None, until=None):
+        """
+        :param since: Optional first collection date (YYYYMMDD) of the
+                      window; snapshots collected before it only count for
+                      the days of the window on which their price held.
+        :param until: Optional last collection date (YYYYMMDD). The last
+                      snapshot of a delta-written route, named by its
+                      details item, holds through it.
+        """
+        self.since = np.datetime64(iso_date(since)) if since else None
+        self.until = np.datetime64(iso_date(until)) if until else None
+        self.route_codes = {}
+        self.routes = []
+        self.prices = []
+        self.departures = []
+        self.collected = []
+        self.previous = []
+        self.last_collected = {}
+
+    def add(self, item):
+        code = self.route_codes.get(item['FlightID'])
+        if code is None:
+            code = self.route_codes[item['FlightID']] = len(self.route_codes)
+        self.routes.append(code)
+        self.prices.append(float(item['price']))
+        self.departures.append(iso_date(item['departure_date']))
+        self.collected.append(iso_date(item['SortKey'][4:]))
+        previous_cid = item.get('previous_cid')
+        self.previous.append(iso_date(previous_cid[4:]) if previous_cid else 'NaT')
+
+    def add_details(self, item):
+        """
+        Records the last snapshot delta writes wrote for a route, from the
+        last_snapshot map of its details item. A last snapshot collected
+        before the window is added from the map, as the scan skips it.
+        """
+        last = item.get('last_snapshot')
+        if last is None:
+            return
+        collected = iso_date(last['cid'][4:])
+        self.last_collected[item['FlightID']] = collected
+        if self.since is not None and np.datetime64(collected) < self.since:
+            self.add({
+                'FlightID': item['FlightID'], 'SortKey': last['cid'], 'price': last['price'],
+                'departure_date': last['departure_date'], 'previous_cid': last.get('previous_cid')
+            })
+
+    def __len__(self):
+        return len(self.prices)
+
+    def previous_keys(self):
+        """
+        Keys of the previous snapshots collected before the window, whose
+        price held on its first days.
+        """
+        if self.since is None:
+            return []
+        names = list(self.route_codes)
+        previous = np.array(self.previous, dtype='datetime64[D]')
+        collected = np.array(self.collected, dtype='datetime64[D]')
+        keys = {
+            (names[self.routes[i]], f"cid_{str(previous[i]).replace('-', '')}")
+            for i in np.flatnonzero((previous < self.since) & (collected > self.since)).tolist()
+        }
+        return [{'FlightID': flight_id, 'SortKey': sort_key} for flight_id, sort_key in keys]
+
+    def arrays(self):
+        """
+        :return: Route codes, prices and departure days since epoch, with
+                 every snapshot repeated for each day it stands for (see
+                 flights_common.snapshots.daily_weights).
+        """
+        routes = np.array(self.routes, dtype=np.int64)
+        collected = np.array(self.collected, dtype='datetime64[D]')
+        last_collected = np.array(
+            [self.last_collected.get(name, 'NaT') for name in self.route_codes], dtype='datetime64[D]'
+        )
+        weights = daily_weights(
+            routes, collected, np.array(self.previous, dtype='datetime64[D]'), self.since, self.until,
+            last_collected[routes] == collected
+        )
+        return (
+            np.repeat(routes, weights),
+            np.repeat(np.array(self.prices, dtype=np.float64), weights),
+            np.repeat(np.array(self.departures, dtype='datetime64[D]').astype(np.int64), weights),
+        )
+
+
+def iso_date(date):
+    """YYYYMMDD -> YYYY-MM-DD, which numpy parses as datetime64."""
+    return f'{date[:4]}-{date[4:6]}-{date[6:8]}'
+
+
+def group_percentiles(groups, prices, percentiles):
+    """
+    Computes percentiles of the prices of every group at once, interpolating
+    between ranks the same way np.percentile does.
+    :param groups: Non-negative group code of every price.
+    :param prices: Prices.
+    :param percentiles: Percentiles in range [0, 100].
+    :return: Codes of the groups found, their sizes and an array of their
+             percentiles with one column per percentile.
+    """
+    order = np.lexsort((prices, groups))
+    groups, prices = groups[order], prices[order]
+    codes, starts, counts = np.unique(groups, return_index=True, return_counts=True)
+    ranks = (counts[:, None] - 1) * (np.asarray(percentiles, dtype=np.float64) / 100)
+    lower = np.floor(ranks).astype(np.int64)
+    upper = np.ceil(ranks).astype(np.int64)
+    lower_values = prices[starts[:, None] + lower]
+    upper_values = prices[starts[:, None] + upper]
+    return codes, counts, lower_values + (upper_values - lower_values) * (ranks - lower)
+
+
+def route_baselines(columns, percentiles, seasons=(), min_count=0):
+    """
+    Computes price baselines per route and, optionally, per route and
+    season of the departure date.
+    :param columns: PriceColumns of the snapshots.
+    :param percentiles: Percentiles to compute.
+    :param seasons: Names of seasons from SEASONS to break the baselines down by.
+    :param min_count: Minimum number of snapshots of a seasonal baseline.
+    :return: Generator of (FlightID, season name or None, season number or
+             None, count, percentile values) tuples.
+    """
+    if not len(columns):
+        return
+    routes, prices, departures = columns.arrays()
+    names = list(columns.route_codes)
+    codes, counts, values = group_percentiles(routes, prices, percentiles)
+    for code, count, row in zip(codes.tolist(), counts.tolist(), values.tolist()):
+        yield names[code], None, None, count, row
+    for season in seasons:
+        size = SEASON_SIZES[season]
+        groups = routes * size + SEASONS[season](departures)
+        codes, counts, values = group_percentiles(groups, prices, percentiles)
+        keep = counts >= min_count
+        for code, count, row in zip(codes[keep].tolist(), counts[keep].tolist(), values[keep].tolist()):
+            yield names[code // size], season, code % size, count, row
@@ -0,0 +1,101 @@
+import os
+import json
+import boto3
+import logging
+import datetime as dt
+from decimal import Decimal
+from boto3.dynamodb.conditions import Attr
+from flights_common.baselines import baseline_sort_key
+from flights_common.metrics import METRICS
+from flights_common.table import FlightsTable
+from .baseline import PriceColumns, route_baselines
+
+PERCENTILES = [int(p) for p in os.environ.get('PERCENTILES', '1,5').split(',')]
+SEASONALITY = [season for season in os.environ.get('SEASONALITY', '').split(',') if season]
+HISTORY_DAYS = int(os.environ.get('HISTORY_DAYS', 0))
+MIN_SEASON_COUNT = int(os.environ.get('MIN_SEASON_COUNT', 15))
+SCAN_SEGMENTS = int(os.environ.get('SCAN_SEGMENTS', 8))
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+dyn_resource = boto3.resource(
+    'dynamodb'
+)
+
+
+def scan_prices(table, segments=SCAN_SEGMENTS, since=None, until=None):
+    """
+    Reads the prices of all snapshots with a parallel Scan, together with
+    the last snapshots delta writes recorded on the routes' details items.
+    With since, the snapshots a delta write skipped from before the window
+    are read too, as their prices held on the window's first days.
+    :param since: Optional first collection date (YYYYMMDD) to include.
+    :param until: Optional last collection date (YYYYMMDD), through which
+                  the routes' last delta-written snapshots hold.
+    :return: PriceColumns of the snapshots.
+    """
+    if since:
+        condition = Attr('SortKey').between(f'cid_{since}', 'cid_99999999')
+    else:
+        condition = Attr('SortKey').begins_with('cid_')
+    condition = condition | Attr('SortKey').eq('details')
+    projection = ['FlightID', 'SortKey', 'price', 'departure_date', 'previous_cid', 'last_snapshot']
+    columns = PriceColumns(since, until)
+    for item in table.scan_items(segments=segments, projection=projection, filter_expression=condition):
+        if item['SortKey'] == 'details':
+            columns.add_details(item)
+        else:
+            columns.add(item)
+    for item in table.batch_get_items(columns.previous_keys(), projection=projection):
+        columns.add(item)
+    return columns
+
+
+def baseline_items(columns, computed_at):
+    """
+    Builds the baseline items of all routes. Each holds the number of
+    collected days, the median and the PERCENTILES of the route's prices.
+    """
+    percentiles = [50] + PERCENTILES
+    baselines = route_baselines(columns, percentiles, SEASONALITY, MIN_SEASON_COUNT)
+    for flight_id, season, number, count, values in baselines:
+        yield {
+            'FlightID': flight_id,
+            'SortKey': baseline_sort_key(season, number),
+            'count': count,
+            'median': Decimal(f'{values[0]:.2f}'),
+            'percentiles': {str(p): Decimal(f'{value:.2f}') for p, value in zip(PERCENTILES, values[1:])},
+            'computed_at': computed_at
+        }
+
+
+def lambda_handler(event, context):
+    """
+    Nightly job precomputing the price baselines of all routes, which the
+    stream handler compares new prices against in STATS_MODE=baseline. It
+    runs after the day's collection, so prices of routes delta writes left
+    unchanged count through its date.
+    """
+    try:
+        table = FlightsTable(dyn_resource)
+        stats = {}
+        if table.exists():
+            today = dt.date.today()
+            since = None
+            if HISTORY_DAYS:
+                since = (today - dt.timedelta(days=HISTORY_DAYS)).strftime('%Y%m%d')
+            with METRICS.timer('scan_prices'):
+                columns = scan_prices(table, since=since, until=today.strftime('%Y%m%d'))
+            logger.info('Scanned %d snapshots of %d routes', len(columns), len(columns.route_codes))
+            with METRICS.timer('route_baselines'):
+                items = list(baseline_items(columns, today.strftime('%Y%m%d')))
+            retried = table.batch_put_items(items)
+            stats = {
+                'snapshots': len(columns), 'routes': len(columns.route_codes), 'written': len(items), 'retried': retried
+            }
+            METRICS.count('baselines', len(items))
+        return {
+            'statusCode': 200,
+            'body': json.dumps(stats)
+        }
+    finally:
+        METRICS.flush(Function='flights-baseline')
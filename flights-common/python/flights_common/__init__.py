@@ -0,0 +1,4 @@
+"""
+DynamoDB access shared by the flights lambdas, deployed as the
+flights-common Lambda layer.
+"""
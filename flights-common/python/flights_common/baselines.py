@@ -0,0 +1,23 @@
+import datetime as dt
+
+# seasons baselines can be broken down by, numbered from 0
+SEASON_SIZES = {'month': 12, 'weekday': 7}
+
+
+def season_number(season, departure_date):
+    """
+    Season of a departure date: month 0 is January, weekday 0 is Monday.
+    :param departure_date: Date in YYYYMMDD format.
+    """
+    if season == 'month':
+        return int(departure_date[4:6]) - 1
+    if season == 'weekday':
+        return dt.date(int(departure_date[:4]), int(departure_date[4:6]), int(departure_date[6:8])).weekday()
+    raise ValueError(f'Unknown season {season}')
+
+
+def baseline_sort_key(season=None, number=None):
+    """Sort key of a route's price baseline, or of its baseline for one season."""
+    if season is None:
+        return 'baseline'
+    return f'baseline_{season}_{number}'
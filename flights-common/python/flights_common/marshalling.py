@@ -0,0 +1,41 @@
+from decimal import Decimal
+from functools import lru_cache
+
+SCALARS = frozenset({str, int, bool, type(None), Decimal})
+
+
+def float_to_decimal(value):
+    # repr gives the shortest round-tripping form, the same text json.dumps emits
+    return Decimal(repr(value))
+
+
+def make_converter(cache_size=0):
+    """
+    Creates a function converting items to the types accepted by DynamoDB:
+    floats become Decimals and tuples become lists, in a single walk over the
+    item. The result matches json.loads(json.dumps(item), parse_float=Decimal)
+    for JSON-compatible items.
+    :param cache_size: Number of float conversions to memoize, 0 (the
+                       default) for none. On flight batches the cache lookup
+                       costs more than the repr it saves (see
+                       benchmarks/bench_marshalling.py).
+    """
+    to_decimal = lru_cache(maxsize=cache_size)(float_to_decimal) if cache_size else float_to_decimal
+
+    def convert(value):
+        value_type = type(value)
+        if value_type is dict:
+            return {
+                key: val if type(val) in SCALARS else convert(val)
+                for key, val in value.items()
+            }
+        if value_type is float:
+            return to_decimal(value)
+        if value_type is list or value_type is tuple:
+            return [val if type(val) in SCALARS else convert(val) for val in value]
+        return value
+
+    return convert
+
+
+to_dynamo = make_converter()
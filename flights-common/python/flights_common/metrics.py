@@ -0,0 +1,114 @@
+import os
+import time
+import json
+import threading
+import functools
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'Flights')
+# per-item logs cost more than the work they describe on the hot loops
+LOG_ITEMS = os.environ.get('LOG_ITEMS', '0') == '1'
+
+
+class Metrics:
+    """
+    Collects stage timings and counters of an invocation and emits them as
+    a single CloudWatch embedded metric format (EMF) record. Stages and
+    counters can be recorded from several threads.
+    """
+
+    def __init__(self, namespace=NAMESPACE, clock=time.perf_counter):
+        self.namespace = namespace
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.timings = {}
+            self.counters = {}
+
+    def add_time(self, stage, seconds, calls=1):
+        """
+        Records time spent in a stage.
+        :param stage: Stage name, e.g. 'get_trips'.
+        :param seconds: Time spent.
+        :param calls: Number of calls the time covers.
+        """
+        with self._lock:
+            timing = self.timings.setdefault(stage, [0, 0.0, 0.0])
+            timing[0] += calls
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, stage):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add_time(stage, self.clock() - start)
+
+    def timed(self, stage=None):
+        """
+        Decorator recording the time spent in the function as a stage.
+        :param stage: Stage name, defaults to the function name.
+        """
+        def decorator(func):
+            name = stage or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self, **dimensions):
+        """
+        Builds the EMF record of the collected metrics.
+        :param dimensions: Dimension values of the record, e.g. Function='flights-download'.
+        :return: EMF record.
+        """
+        with self._lock:
+            timings = {stage: list(timing) for stage, timing in self.timings.items()}
+            counters = dict(self.counters)
+        record = dict(dimensions)
+        definitions = []
+        for stage, (calls, total, longest) in timings.items():
+            record[f'{stage}.calls'] = calls
+            record[f'{stage}.time'] = round(total * 1000, 3)
+            record[f'{stage}.max'] = round(longest * 1000, 3)
+            definitions.append({'Name': f'{stage}.calls', 'Unit': 'Count'})
+            definitions.append({'Name': f'{stage}.time', 'Unit': 'Milliseconds'})
+            definitions.append({'Name': f'{stage}.max', 'Unit': 'Milliseconds'})
+        for name, value in counters.items():
+            record[name] = value
+            definitions.append({'Name': name, 'Unit': 'Count'})
+        record['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': self.namespace,
+                'Dimensions': [list(dimensions)],
+                'Metrics': definitions
+            }]
+        }
+        return record
+
+    def flush(self, **dimensions):
+        """
+        Prints the EMF record to stdout, where CloudWatch Logs extracts the
+        metrics from, and starts collecting the next invocation.
+        :return: The emitted record.
+        """
+        record = self.summary(**dimensions)
+        print(json.dumps(record), flush=True)
+        self.reset()
+        return record
+
+
+METRICS = Metrics()
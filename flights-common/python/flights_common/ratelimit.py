@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import deque
+
+THROTTLING_ERRORS = {
+    'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'
+}
+
+
+def consumed_units(response):
+    """
+    Sums CapacityUnits of the ConsumedCapacity returned with a response.
+    Responses that report no capacity count as a single unit.
+    """
+    consumed = response.get('ConsumedCapacity')
+    if not consumed:
+        return 1.0
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return sum(float(capacity.get('CapacityUnits', 0)) for capacity in consumed)
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket of DynamoDB capacity units. It does not limit anything until
+    DynamoDB throttles a request; the rate is then set below the recently
+    consumed capacity and recovers additively while requests succeed. Once
+    no throttling was seen for `recovery` seconds the limit is lifted.
+    Safe to share between threads.
+    """
+
+    def __init__(self, min_rate=1.0, decrease=0.5, increase=1.0, recovery=30.0, window=1.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        :param min_rate: Lowest rate in units per second.
+        :param decrease: Factor applied to the rate on each throttle.
+        :param increase: Units per second the rate grows by, per second without throttling.
+        :param recovery: Seconds without throttling after which the limit is lifted.
+        :param window: Seconds of history used to measure consumed capacity.
+        """
+        self.min_rate = min_rate
+        self.decrease = decrease
+        self.increase = increase
+        self.recovery = recovery
+        self.window = window
+        self.clock = clock
+        self.sleep = sleep
+        self.rate = None
+        self.tokens = 0.0
+        self.updated = clock()
+        self.last_throttle = None
+        self.decreased = None
+        self.consumed = deque()
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        if self.rate is None:
+            return
+        if now - self.last_throttle > self.recovery:
+            self.rate = None
+            self.tokens = 0.0
+            return
+        self.rate += self.increase * elapsed
+        self.tokens = min(self.tokens + elapsed * self.rate, self.rate)
+
+    def observed_rate(self, now):
+        while self.consumed and now - self.consumed[0][0] > self.window:
+            self.consumed.popleft()
+        return sum(units for _, units in self.consumed) / self.window
+
+    def acquire(self):
+        """Blocks until the bucket is out of debt."""
+        with self._lock:
+            self._refill(self.clock())
+            if self.rate is None or self.tokens >= 0:
+                return
+            wait = -self.tokens / self.rate
+        self.sleep(wait)
+
+    def record(self, units):
+        """Charges the units consumed by a successful request."""
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self.consumed.append((now, units))
+            if self.rate is not None:
+                self.tokens -= units
+
+    def throttled(self):
+        """
+        Lowers the rate after DynamoDB pushed back. Throttles within one
+        window of the last decrease are taken as the same event, so parallel
+        requests failing together lower the rate only once.
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            if self.rate is None or now - self.decreased > self.window:
+                current = self.rate if self.rate is not None else self.observed_rate(now)
+                self.rate = max(self.min_rate, current * self.decrease)
+                self.decreased = now
+            self.tokens = min(self.tokens, 0.0) - 1
+            self.last_throttle = now
+            self.throttles += 1
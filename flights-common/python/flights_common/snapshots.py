@@ -0,0 +1,111 @@
+import os
+import datetime as dt
+
+# attributes of the snapshot a route's details item remembers for delta writes
+LAST_SNAPSHOT_FIELDS = ('cid', 'price', 'departure_date', 'return_date', 'previous_cid', 'previous_price')
+# Delta writes cannot tell an unchanged route from one missing from Kayak's
+# responses, so the days a route was missing count at its last price too,
+# where a table written every day has no snapshot for them. This caps the
+# days counted per skipped run; 0 counts every written snapshot once.
+MAX_CARRIED_DAYS = int(os.environ['MAX_CARRIED_DAYS']) if os.environ.get('MAX_CARRIED_DAYS') else None
+
+
+def cid_date(sort_key):
+    """Collection date of a cid_YYYYMMDD sort key."""
+    return dt.date(int(sort_key[4:8]), int(sort_key[8:10]), int(sort_key[10:12]))
+
+
+def is_unchanged(last_snapshot, price, departure_date, return_date):
+    """
+    Whether a route's new price and dates match the last snapshot written.
+    :param last_snapshot: last_snapshot map of the route's details item.
+    """
+    return (
+        float(last_snapshot['price']) == float(price)
+        and last_snapshot['departure_date'] == departure_date
+        and last_snapshot['return_date'] == return_date
+    )
+
+
+def unchanged_days(item, since=None):
+    """
+    Days a delta-written snapshot skipped: those between the previous
+    snapshot and this one, on which the route still had previous_price, or
+    was missing (see MAX_CARRIED_DAYS). daily_weights applies the same rule
+    to columns of many routes.
+    :param item: Snapshot with SortKey and, when delta-written, previous_cid.
+    :param since: Optional first collection date (YYYYMMDD) to count.
+    :return: Number of days, 0 for snapshots written every day.
+    """
+    previous_cid = item.get('previous_cid')
+    if not previous_cid:
+        return 0
+    first = cid_date(previous_cid) + dt.timedelta(days=1)
+    if since:
+        first = max(first, cid_date(f'cid_{since}'))
+    days = max((cid_date(item['SortKey']) - first).days, 0)
+    return days if MAX_CARRIED_DAYS is None else min(days, MAX_CARRIED_DAYS)
+
+
+def daily_prices(items, since=None):
+    """
+    Prices of a route's snapshots with one price per collected day: the
+    previous price of a delta-written snapshot is repeated for the days it
+    skipped (see unchanged_days).
+    :param items: Snapshots with SortKey, price and optionally previous_cid
+                  and previous_price, in any order.
+    :param since: Optional first collection date (YYYYMMDD) to count.
+    """
+    prices = []
+    for item in items:
+        prices.append(float(item['price']))
+        days = unchanged_days(item, since)
+        if days:
+            prices.extend([float(item['previous_price'])] * days)
+    return prices
+
+
+def daily_weights(routes, collected, previous, since=None, until=None, current=None):
+    """
+    Number of collected days every snapshot stands for, unchanged_days over
+    columns of many routes: its own day and the days a delta write skipped
+    before the route's next snapshot, on which its price still held. A
+    route's last snapshot that is still current holds up to until, as no
+    later snapshot records the days it skipped. Within a window starting at
+    since, only the window's days count.
+    :param routes: Route of every snapshot, as numpy codes or names.
+    :param collected: Collection dates (datetime64[D]).
+    :param previous: Collection dates of the previous snapshots recorded
+                     by delta writes, NaT for snapshots written every day.
+    :param since: Optional first day of the window (datetime64[D]).
+    :param until: Optional last collected day (datetime64[D]).
+    :param current: Optional boolean mask of the snapshots delta writes
+                    last wrote for their routes (see LAST_SNAPSHOT_FIELDS).
+    :return: Weights in the order of the snapshots.
+    """
+    # imported here, the stream handler only needs the single-route rule
+    import numpy as np
+    weights = np.ones(len(routes), dtype=np.int64)
+    order = np.lexsort((collected, routes))
+    routes, collected, previous = routes[order], collected[order], previous[order]
+    # NaT never compares equal, so snapshots written every day add nothing
+    follows = (routes[1:] == routes[:-1]) & (previous[1:] == collected[:-1])
+    first_skipped = collected[:-1] + 1
+    if since is not None:
+        weights[order[collected < since]] = 0
+        first_skipped = np.maximum(first_skipped, since)
+    skipped = np.maximum((collected[1:] - first_skipped).astype(np.int64), 0)
+    if MAX_CARRIED_DAYS is not None:
+        skipped = np.minimum(skipped, MAX_CARRIED_DAYS)
+    weights[order[:-1][follows]] += skipped[follows]
+    if until is not None and current is not None:
+        # a stale mask entry of a route written every day since is not its last snapshot
+        current = current[order] & np.append(routes[1:] != routes[:-1], True)
+        first_held = collected[current] + 1
+        if since is not None:
+            first_held = np.maximum(first_held, since)
+        held = np.maximum((until + 1 - first_held).astype(np.int64), 0)
+        if MAX_CARRIED_DAYS is not None:
+            held = np.minimum(held, MAX_CARRIED_DAYS)
+        weights[order[current]] += held
+    return weights
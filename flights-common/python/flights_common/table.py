@@ -0,0 +1,604 @@
+import time
+import json
+import queue
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from .marshalling import to_dynamo
+from .metrics import LOG_ITEMS, METRICS
+from .ratelimit import THROTTLING_ERRORS, AdaptiveRateLimiter, consumed_units
+from .snapshots import LAST_SNAPSHOT_FIELDS, is_unchanged
+
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+SCAN_SEGMENTS = 4
+WRITE_WORKERS = 4
+MAX_BACKOFF = 20
+# share of changed snapshots above which delta writes cost more than full
+# ones: a route costs 0.5 RCU (~0.1 WCU at on-demand and provisioned prices)
+# to read plus 2 WCU when changed, against 1 WCU written every day
+DELTA_BREAK_EVEN = 0.45
+logger = logging.getLogger(__name__)
+
+
+def projection_params(projection):
+    """
+    Builds the projection parameters of a request.
+    :param projection: ProjectionExpression or a list of attribute names.
+                       Names are passed through placeholders, so reserved
+                       words such as 'days' can be projected too.
+    :return: Request parameters.
+    """
+    if not projection:
+        return {}
+    if isinstance(projection, str):
+        return {'ProjectionExpression': projection}
+    names = {f'#p{i}': name for i, name in enumerate(projection)}
+    return {'ProjectionExpression': ', '.join(names), 'ExpressionAttributeNames': names}
+
+
+class DynamoDBTable:
+    """Encapsulates an Amazon DynamoDB table."""
+    table_name = None
+
+    
+    def __init__(self, dyn_resource, rate_limiter=None, retries=5, backoff=0.05):
+        """
+        :param dyn_resource: A Boto3 DynamoDB resource.
+        :param rate_limiter: AdaptiveRateLimiter shared by the table requests.
+                             Pass the same one across invocations to keep
+                             the learned rate.
+        :param retries: Number of retries of throttled requests.
+        :param backoff: Base backoff in seconds before resubmitting
+                        unprocessed items.
+        """
+        self.dyn_resource = dyn_resource
+        self.table = None
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.retries = retries
+        self.backoff = backoff
+
+    def exists(self):
+        """
+        Determines whether a table exists. As a side effect, stores the table in
+        a member variable.
+        :param table_name: The name of the table to check.
+        :return: True when the table exists; otherwise, False.
+        """
+        try:
+            table = self.dyn_resource.Table(self.table_name)
+            table.load()
+            exists = True
+        except ClientError as err:
+            if err.response['Error']['Code'] == 'ResourceNotFoundException':
+                exists = False
+            else:
+                logger.error(
+                    "Unable to check if table %s exists. %s: %s", self.table_name, 
+                    err.response['Error']['Code'], err.response['Error']['Message']
+                )
+                raise
+        else:
+            self.table = table
+        return exists
+
+    def request(self, method, **kwargs):
+        """
+        Sends a request through the rate limiter, asking for consumed capacity.
+        Throttled requests lower the rate and are retried.
+        :param method: Boto3 method to call, e.g. self.table.query.
+        :return: The response.
+        """
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = method(ReturnConsumedCapacity='TOTAL', **kwargs)
+            except ClientError as err:
+                if err.response['Error']['Code'] not in THROTTLING_ERRORS or attempt == self.retries:
+                    raise
+                logger.warning("Throughput exceeded on %s, retry %d", self.table_name, attempt + 1)
+                METRICS.count('dynamodb.throttles')
+                self.rate_limiter.throttled()
+                attempt += 1
+            else:
+                units = consumed_units(response)
+                METRICS.count('dynamodb.requests')
+                METRICS.count('dynamodb.capacity', units)
+                self.rate_limiter.record(units)
+                return response
+
+    def write_batch(self, items: list):
+        """
+        Fills an Amazon DynamoDB table with the specified data, using the Boto3
+        Table.batch_writer() function to put the items in the table.
+        Inside the context manager, Table.batch_writer builds a list of
+        requests. On exiting the context manager, Table.batch_writer starts sending
+        batches of write requests to Amazon DynamoDB and automatically
+        handles chunking, buffering, and retrying.
+        :param items: The data to put in the table. Each item must contain at least
+                       the keys required by the schema that was specified when the
+                       table was created.
+        """
+        try:
+            with self.table.batch_writer() as writer:
+                for item in items:
+                    writer.put_item(Item=to_dynamo(item))
+        except ClientError as err:
+            logger.error(
+                "Couldn't load data into table %s. %s: %s", self.table.name,
+                err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+        else:
+            return json.dumps(f'Successfully uploaded {len(items)} items')
+
+    def add_item(self, item: dict):
+        """
+        Adds a item to the table.
+        :param item: The item to be added.
+        """
+        try:
+            parsed_item = to_dynamo(item)
+            self.request(self.table.put_item, Item=parsed_item)
+        except ClientError as err:
+            logger.error(
+                "Couldn't add item to the table. %s: %s",
+                err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+        else:
+            return json.dumps(item)
+
+    def add_item_if(self, item: dict, condition, values=None, names=None):
+        """
+        Adds an item only when the condition holds for the stored item.
+        :param item: The item to be added.
+        :param condition: ConditionExpression, e.g. 'attribute_not_exists(SortKey)'.
+        :param values: Optional ExpressionAttributeValues of the condition.
+        :param names: Optional ExpressionAttributeNames of the condition.
+        :return: True when the item was written, False when the condition failed.
+        """
+        params = {'ConditionExpression': condition}
+        if values:
+            params['ExpressionAttributeValues'] = to_dynamo(values)
+        if names:
+            params['ExpressionAttributeNames'] = names
+        try:
+            self.request(self.table.put_item, Item=to_dynamo(item), **params)
+        except ClientError as err:
+            if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            logger.error(
+                "Couldn't add item to the table. %s: %s",
+                err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+        return True
+
+    def get_item(self, key: dict):
+        """
+        Gets single item from the table.
+        :param key: Key of the item in the database.
+        :return: Item data.
+        """
+        try:
+            response = self.request(self.table.get_item, Key=key)
+        except ClientError as err:
+            logger.error(
+                "Couldn't get item %s. %s: %s", key,
+                err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+        else:
+            return response
+
+    def batch_get_items(self, keys: list, projection=None):
+        """
+        Gets multiple items from the table using BatchGetItem requests of up to
+        100 keys each. Unprocessed keys are resubmitted once the rate limiter
+        has backed off, giving up after retries rounds without progress.
+        :param keys: Keys of the items in the database.
+        :param projection: Optional ProjectionExpression or list of attribute
+                           names of the returned fields.
+        :return: Found items, in no particular order.
+        """
+        data = []
+        for start in range(0, len(keys), BATCH_GET_SIZE):
+            request = {'Keys': keys[start:start + BATCH_GET_SIZE], **projection_params(projection)}
+            attempt = 0
+            while request:
+                try:
+                    response = self.request(self.dyn_resource.batch_get_item, RequestItems={self.table_name: request})
+                except ClientError as err:
+                    logger.error(
+                        "Couldn't get items from table %s. %s: %s", self.table_name,
+                        err.response['Error']['Code'], err.response['Error']['Message'])
+                    raise
+                data.extend(response['Responses'].get(self.table_name, []))
+                unprocessed = response.get('UnprocessedKeys', {}).get(self.table_name)
+                if unprocessed:
+                    # only rounds that make no progress count against the retries
+                    attempt = attempt + 1 if len(unprocessed['Keys']) == len(request['Keys']) else 0
+                    if attempt > self.retries:
+                        raise RuntimeError(
+                            f"{len(unprocessed['Keys'])} keys still unprocessed by {self.table_name} "
+                            f"after {self.retries} retries"
+                        )
+                    METRICS.count('dynamodb.throttles')
+                    self.rate_limiter.throttled()
+                request = unprocessed
+        return data
+
+    def _put_chunk(self, requests):
+        """
+        Sends one BatchWriteItem request and resubmits its unprocessed items
+        until all are written. Resubmissions wait with decorrelated jitter
+        backoff, so parallel writers do not retry in lockstep.
+        :param requests: Up to 25 put requests.
+        :return: Number of items that had to be resubmitted.
+        """
+        retried = attempt = 0
+        sleep = self.backoff
+        while True:
+            try:
+                response = self.request(self.dyn_resource.batch_write_item, RequestItems={self.table_name: requests})
+            except ClientError as err:
+                logger.error(
+                    "Couldn't load data into table %s. %s: %s", self.table_name,
+                    err.response['Error']['Code'], err.response['Error']['Message'])
+                raise
+            unprocessed = response.get('UnprocessedItems', {}).get(self.table_name)
+            if not unprocessed:
+                return retried
+            # only rounds that make no progress count against the retries
+            attempt = attempt + 1 if len(unprocessed) == len(requests) else 0
+            if attempt > self.retries:
+                raise RuntimeError(
+                    f'{len(unprocessed)} items still unprocessed by {self.table_name} after {self.retries} retries'
+                )
+            requests = unprocessed
+            retried += len(requests)
+            METRICS.count('dynamodb.throttles')
+            # only the unprocessed part backs off, the rate limiter keeps
+            # pacing the other writers
+            sleep = min(MAX_BACKOFF, random.uniform(self.backoff, sleep * 3))
+            logger.warning("%d items unprocessed by %s. Sleeping for %.2f s", len(requests), self.table_name, sleep)
+            time.sleep(sleep)
+
+    def batch_put_items(self, items: list, max_workers=WRITE_WORKERS):
+        """
+        Puts items using BatchWriteItem requests of up to 25 items each, sent
+        in parallel. Unprocessed items are resubmitted with jittered backoff.
+        Unlike Table.batch_writer, the items are not deduplicated, so their
+        keys must be unique.
+        :param items: The items to put.
+        :param max_workers: Maximum number of requests in flight.
+        :return: Number of items that had to be resubmitted.
+        """
+        chunks = [
+            [{'PutRequest': {'Item': to_dynamo(item)}} for item in items[start:start + BATCH_WRITE_SIZE]]
+            for start in range(0, len(items), BATCH_WRITE_SIZE)
+        ]
+        if len(chunks) <= 1 or max_workers <= 1:
+            return sum(self._put_chunk(chunk) for chunk in chunks)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            return sum(executor.map(self._put_chunk, chunks))
+
+    def query_items(self, key, value, sort_condition=None, projection=None, limit=None):
+        """
+        Queries for items that match specifier key=value criteria.
+        Optionally return only specified fields.
+        :param key: Item key.
+        :param value: Key value.
+        :param sort_condition: Optional condition on the sort key, e.g.
+                               Key('SortKey').begins_with('cid_').
+        :param projection: Optional ProjectionExpression or list of attribute
+                           names of the returned fields.
+        :param limit: Optional number of items evaluated per page.
+        :return: Matched items.
+        """
+        condition = Key(key).eq(value)
+        if sort_condition is not None:
+            condition = condition & sort_condition
+        params = {'KeyConditionExpression': condition, **projection_params(projection)}
+        if limit:
+            params['Limit'] = limit
+        try:
+            response = self.request(self.table.query, **params)
+            data = response['Items']
+            METRICS.count('query_items.pages')
+            while 'LastEvaluatedKey' in response:
+                response = self.request(
+                    self.table.query,
+                    ExclusiveStartKey=response['LastEvaluatedKey'],
+                    **params
+                ) 
+                data.extend(response['Items'])
+                METRICS.count('query_items.pages')
+        except ClientError as err:
+            logger.error(
+                "Query failed: %s: %s", err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+        else:
+            return data
+
+    def scan_items(self, segments=SCAN_SEGMENTS, projection=None, filter_expression=None, page_size=None):
+        """
+        Reads the whole table with a parallel Scan, one worker per segment.
+        Pages are handed over through a bounded queue as they arrive, so the
+        table is never held in memory as a whole.
+        :param segments: Number of segments scanned in parallel.
+        :param projection: Optional ProjectionExpression or list of attribute
+                           names of the returned fields.
+        :param filter_expression: Optional filter condition, e.g.
+                                  Attr('SortKey').begins_with('cid_').
+        :param page_size: Optional number of items evaluated per page.
+        :return: Generator of items, in no particular order.
+        """
+        params = {'TotalSegments': segments, **projection_params(projection)}
+        if filter_expression is not None:
+            params['FilterExpression'] = filter_expression
+        if page_size:
+            params['Limit'] = page_size
+        pages = queue.Queue(maxsize=2 * segments)
+        stop = threading.Event()
+        done = object()
+
+        def put(entry):
+            while not stop.is_set():
+                try:
+                    pages.put(entry, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def worker(segment):
+            try:
+                start_key = {}
+                while not stop.is_set():
+                    response = self.request(self.table.scan, Segment=segment, **start_key, **params)
+                    METRICS.count('scan_items.pages')
+                    put(response['Items'])
+                    if 'LastEvaluatedKey' not in response:
+                        break
+                    start_key = {'ExclusiveStartKey': response['LastEvaluatedKey']}
+            except Exception as err:
+                put(err)
+            finally:
+                put(done)
+
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            for segment in range(segments):
+                executor.submit(worker, segment)
+            remaining = segments
+            try:
+                while remaining:
+                    entry = pages.get()
+                    if entry is done:
+                        remaining -= 1
+                        continue
+                    if isinstance(entry, ClientError):
+                        logger.error(
+                            "Scan failed: %s: %s", entry.response['Error']['Code'],
+                            entry.response['Error']['Message'])
+                    if isinstance(entry, Exception):
+                        raise entry
+                    yield from entry
+            finally:
+                stop.set()
+
+
+class FlightsTable(DynamoDBTable):
+    table_name = 'flights'
+
+    def __init__(self, dyn_resource, backoff=0.05, retries=5, known_routes=None, rate_limiter=None,
+                 delta_writes=False):
+        """
+        :param dyn_resource: A Boto3 DynamoDB resource.
+        :param backoff: Base backoff in seconds for unprocessed writes.
+        :param retries: Number of retries of throttled requests.
+        :param known_routes: Optional set of FlightIDs known to have details
+                             written. It is updated in place, so passing the
+                             same set across invocations skips their reads.
+        :param rate_limiter: AdaptiveRateLimiter shared by the table requests.
+        :param delta_writes: Write snapshots only when the route's price or
+                             dates changed since its last snapshot.
+        """
+        super().__init__(dyn_resource, rate_limiter=rate_limiter, retries=retries, backoff=backoff)
+        self.known_routes = known_routes if known_routes is not None else set()
+        self.delta_writes = delta_writes
+
+    
+    def load_known_routes(self, flight_ids):
+        """
+        Checks in bulk which routes already have details written and adds
+        them to known_routes. Routes already in known_routes are not read.
+        :param flight_ids: FlightIDs to check.
+        """
+        keys = [
+            {'FlightID': flight_id, 'SortKey': 'details'}
+            for flight_id in set(flight_ids) - self.known_routes
+        ]
+        found = self.batch_get_items(keys, projection='FlightID')
+        self.known_routes.update(item['FlightID'] for item in found)
+
+    def load_last_snapshots(self, flight_ids):
+        """
+        Reads the last snapshot written of every route in bulk, from the
+        routes' details items, and adds the routes found to known_routes.
+        :param flight_ids: FlightIDs to read.
+        :return: last_snapshot maps keyed by FlightID, for routes that have one.
+        """
+        keys = [{'FlightID': flight_id, 'SortKey': 'details'} for flight_id in set(flight_ids)]
+        found = self.batch_get_items(keys, projection=['FlightID', 'last_snapshot'])
+        self.known_routes.update(item['FlightID'] for item in found)
+        return {item['FlightID']: item['last_snapshot'] for item in found if 'last_snapshot' in item}
+
+    @METRICS.timed('write_batch')
+    def write_batch(self, items: list):
+        """
+        Writes flight snapshots, adding the details of routes not written
+        before. Their total_agg item is left to the stream handler, which
+        seeds it from the first snapshot; a blind put could land after that
+        and wipe the sketch. With delta_writes, snapshots matching the
+        route's last one are skipped; the others record the previous
+        snapshot's sort key and price and are written together with the
+        route's details, which remember them as last_snapshot.
+        :param items: Flights with unique keys.
+        :return: Numbers of items written, of snapshots skipped as unchanged
+                 and of items that were resubmitted.
+        """
+        if self.delta_writes:
+            last_snapshots = self.load_last_snapshots(item.flight_id for item in items)
+        else:
+            self.load_known_routes(item.flight_id for item in items)
+        new_routes = set()
+        puts = []
+        unchanged = compared = 0
+        for item in items:
+            key = item.flight_id
+            snapshot = item.flight_details
+            if self.delta_writes:
+                last = last_snapshots.get(key)
+                compared += last is not None
+                if last is not None and is_unchanged(last, item.price, item.departure_date, item.return_date):
+                    unchanged += 1
+                    continue
+                if last is not None and last['cid'] < item.sort_key:
+                    snapshot.update(previous_cid=last['cid'], previous_price=last['price'])
+                elif last is not None and last.get('previous_cid'):
+                    # the route's snapshot of this collection is replaced, keep what it skipped
+                    snapshot.update(previous_cid=last['previous_cid'], previous_price=last['previous_price'])
+            if LOG_ITEMS:
+                logger.info('Writing item: %s', key)
+            if key not in self.known_routes and key not in new_routes:
+                new_routes.add(key)
+                if not self.delta_writes:
+                    puts.append(item.route_details)
+            if self.delta_writes:
+                last_snapshot = dict(snapshot, cid=item.sort_key)
+                puts.append({
+                    **item.route_details,
+                    'last_snapshot': {
+                        name: last_snapshot[name] for name in LAST_SNAPSHOT_FIELDS if name in last_snapshot
+                    }
+                })
+            puts.append(snapshot)
+        retried = self.batch_put_items(puts)
+        self.known_routes.update(new_routes)
+        METRICS.count('write_batch.retried', retried)
+        METRICS.count('write_batch.unchanged', unchanged)
+        if compared and 1 - unchanged / compared > DELTA_BREAK_EVEN:
+            logger.warning(
+                '%.0f%% of snapshots changed, above the %.0f%% at which delta writes stop saving capacity',
+                100 * (1 - unchanged / compared), 100 * DELTA_BREAK_EVEN
+            )
+        logger.info('Successfully uploaded %d items, skipped %d unchanged', len(puts), unchanged)
+        return {'written': len(puts), 'unchanged': unchanged, 'retried': retried}
+
+    def query_prices(self, flight_id, since=None, page_size=None):
+        """
+        Reads only the prices of a route's snapshots, skipping its details
+        and aggregate items.
+        :param flight_id: Route key.
+        :param since: Optional first collection date (YYYYMMDD) to include.
+        :param page_size: Optional number of items per page.
+        :return: Items with the price attribute and, for delta-written
+                 snapshots, the previous snapshot's sort key and price
+                 (see snapshots.daily_prices).
+        """
+        if since:
+            sort_condition = Key('SortKey').between(f'cid_{since}', 'cid_99999999')
+        else:
+            sort_condition = Key('SortKey').begins_with('cid_')
+        return self.query_items(
+            'FlightID', flight_id, sort_condition, projection=['SortKey', 'price', 'previous_cid', 'previous_price'],
+            limit=page_size
+        )
+
+    def update_price_stats(self, flight_id, sort_key, price, bucket, carried=None):
+        """
+        Atomically adds a new price snapshot to the route's total_agg item.
+        The update only applies to snapshots newer than the last one counted,
+        so retried stream records are not counted twice.
+        :param flight_id: Route key.
+        :param sort_key: Sort key of the new snapshot (cid_YYYYMMDD).
+        :param price: Snapshot price.
+        :param bucket: Price histogram bucket of the snapshot.
+        :param carried: Optional (price, bucket, days) of the previous price,
+                        counted once for every day a delta write skipped.
+        :return: Updated total_agg item or None when the item has no price
+                 histogram yet and has to be seeded from history.
+        """
+        key = {'FlightID': flight_id, 'SortKey': 'total_agg'}
+        counts = {bucket: 1}
+        count, total = 1, Decimal(str(price))
+        if carried:
+            carried_price, carried_bucket, days = carried
+            counts[carried_bucket] = counts.get(carried_bucket, 0) + days
+            count, total = count + days, total + Decimal(str(carried_price)) * days
+        names = {f'#b{i}': str(index) for i, index in enumerate(counts)}
+        values = {f':n{i}': n for i, n in enumerate(counts.values())}
+        try:
+            response = self.request(
+                self.table.update_item,
+                Key=key,
+                UpdateExpression='ADD count_total :count, price_total :price, '
+                                 + ', '.join(f'price_hist.#b{i} :n{i}' for i in range(len(counts)))
+                                 + ' SET last_cid = :cid',
+                ConditionExpression='attribute_not_exists(last_cid) OR last_cid < :cid',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues={**values, ':count': count, ':price': total, ':cid': sort_key},
+                ReturnValues='ALL_NEW'
+            )
+        except ClientError as err:
+            if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return self.get_item(key).get('Item')
+            if err.response['Error']['Code'] == 'ValidationException' \
+                    and 'document path' in err.response['Error']['Message']:
+                return None
+            logger.error(
+                "Couldn't update price stats of %s. %s: %s", flight_id,
+                err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+        else:
+            return response['Attributes']
+
+    def seed_price_stats(self, flight_id, sort_key, prices, price_hist):
+        """
+        Initializes price stats of a route from its full price history.
+        :param flight_id: Route key.
+        :param sort_key: Sort key of the newest snapshot included in prices.
+        :param prices: All prices of the route.
+        :param price_hist: Price histogram built from prices.
+        :return: Seeded total_agg item.
+        """
+        key = {'FlightID': flight_id, 'SortKey': 'total_agg'}
+        try:
+            response = self.request(
+                self.table.update_item,
+                Key=key,
+                UpdateExpression='SET count_total = :count, price_total = :total, '
+                                 'price_hist = :hist, last_cid = :cid',
+                ConditionExpression='attribute_not_exists(price_hist)',
+                ExpressionAttributeValues={
+                    ':count': len(prices),
+                    ':total': Decimal(str(sum(prices))),
+                    ':hist': price_hist,
+                    ':cid': sort_key
+                },
+                ReturnValues='ALL_NEW'
+            )
+        except ClientError as err:
+            if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return self.get_item(key).get('Item')
+            logger.error(
+                "Couldn't seed price stats of %s. %s: %s", flight_id,
+                err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+        else:
+            return response['Attributes']
+
+    def __repr__(self):
+        return '%s.DynamoDBTable object' % self.table_name
@@ -0,0 +1,116 @@
+import os
+import shutil
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from .utils import ORIGIN_INDEX, distances, origin_coordinates_map
+
+CACHE_PATH = os.environ.get('AIRPORT_CACHE_PATH', '/tmp/airports.db')
+SEED_PATH = Path(__file__).with_name('airports.db')
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS airports (
+    code TEXT PRIMARY KEY, latitude REAL, longitude REAL, city TEXT, country TEXT
+);
+CREATE TABLE IF NOT EXISTS distances (
+    code TEXT, origin TEXT, km REAL, PRIMARY KEY (code, origin)
+);
+CREATE TABLE IF NOT EXISTS routes (
+    flight_id TEXT PRIMARY KEY
+);
+"""
+logger = logging.getLogger(__name__)
+
+
+class AirportCache:
+    """
+    Destination airport metadata and distances to every origin, keyed by
+    airport code and kept in a SQLite file that survives warm invocations.
+    FlightIDs whose details are already in the table are kept alongside, so
+    known routes need no DynamoDB reads. Safe to share between threads.
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        """
+        :param path: Location of the cache file. When it does not exist yet,
+                     the airports.db shipped with the function is copied there.
+        """
+        if not os.path.exists(path) and SEED_PATH.exists():
+            shutil.copyfile(SEED_PATH, path)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.executescript(SCHEMA)
+        self.airports = {
+            code: (latitude, longitude, city, country)
+            for code, latitude, longitude, city, country
+            in self.conn.execute('SELECT code, latitude, longitude, city, country FROM airports')
+        }
+        self.distances = {
+            (code, origin): km
+            for code, origin, km in self.conn.execute('SELECT code, origin, km FROM distances')
+        }
+        self.routes = {flight_id for flight_id, in self.conn.execute('SELECT flight_id FROM routes')}
+        self.saved_routes = set(self.routes)
+        logger.info('Loaded %d airports and %d routes from %s', len(self.airports), len(self.routes), path)
+
+    def add_destinations(self, destinations):
+        """
+        Stores metadata of airports not seen before, with their distances to
+        all origins computed in one NumPy pass per origin.
+        :param destinations: Kayak destinations array.
+        """
+        with self._lock:
+            self._add_destinations(destinations)
+
+    def _add_destinations(self, destinations):
+        new = {}
+        for trip in destinations:
+            code = trip['airport']['shortName']
+            if code not in self.airports and code not in new:
+                new[code] = (
+                    trip['airport']['latitude'], trip['airport']['longitude'],
+                    trip['city']['name'], trip['country']['name']
+                )
+        if not new:
+            return
+        # NumPy is only needed for airports missing from the cache
+        import numpy as np
+
+        codes = list(new)
+        lat = np.array([new[code][0] for code in codes], dtype=float)
+        lon = np.array([new[code][1] for code in codes], dtype=float)
+        rows = []
+        for origin, origin_idx in ORIGIN_INDEX.items():
+            km = distances(np.full(len(codes), origin_idx), lat, lon)
+            rows.extend((code, origin, float(d)) for code, d in zip(codes, km))
+        self.airports.update(new)
+        self.distances.update(((code, origin), km) for code, origin, km in rows)
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO airports VALUES (?, ?, ?, ?, ?)',
+                [(code, *metadata) for code, metadata in new.items()]
+            )
+            self.conn.executemany('INSERT OR REPLACE INTO distances VALUES (?, ?, ?)', rows)
+
+    def is_long(self, origin, code):
+        return self.distances[(code, origin)] > origin_coordinates_map[origin]['limit']
+
+    def save_routes(self):
+        """Persists FlightIDs added to routes since the last save."""
+        with self._lock:
+            new_routes = self.routes - self.saved_routes
+            if new_routes:
+                with self.conn:
+                    self.conn.executemany('INSERT OR IGNORE INTO routes VALUES (?)', [(r,) for r in new_routes])
+                self.saved_routes |= new_routes
+
+
+_cache = None
+
+
+def get_airport_cache():
+    """Returns the cache, opening it once per execution environment."""
+    global _cache
+    if _cache is None:
+        _cache = AirportCache()
+    return _cache
@@ -0,0 +1,244 @@
+import gzip
+import json
+import time
+import queue
+import logging
+import threading
+import requests
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from flights_common.metrics import METRICS
+from .httpcache import TeeReader, get_response_cache
+try:
+    import ijson
+except ImportError:
+    ijson = None
+try:
+    # urllib3 decodes br bodies only when a brotli package is installed
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+
+HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Accept-Encoding': ACCEPT_ENCODING,
+    'Accept-Language': 'pl,en-US;q=0.7,en;q=0.3',
+    'Connection': 'keep-alive',
+    'Host': 'www.kayak.pl',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+    'TE': 'trailers',
+    'Upgrade-Insecure-Requests': '1',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:106.0) Gecko/20100101 Firefox/106.0',
+}
+URL_ENDPOINT = 'https://www.kayak.pl/s/horizon/exploreapi/destinations?'\
+    'airport={d[origin_place_id]}&'\
+    'budget={d[budget]}&'\
+    'tripdurationrange={d[days_range]}&'\
+    'duration=&'\
+    'flightMaxStops={d[max_stops]}&'\
+    'stopsFilterActive=false&topRightLat=80&topRightLon=180&bottomLeftLat=-65&bottomLeftLon=-180&zoomLevel=1&'\
+    'selectedMarker=&themeCode={d[theme]}&selectedDestination='
+QUERY_FIELDS = ('origin_place_id', 'days_range', 'budget', 'max_stops', 'theme')
+# raised by bodies that are not the expected JSON, e.g. a captcha page
+PARSE_ERRORS = (ValueError, KeyError) + ((ijson.JSONError,) if ijson is not None else ())
+MAX_CONCURRENCY = 8
+CHUNK_SIZE = 256
+logger = logging.getLogger(__name__)
+
+
+def make_session(pool_size=MAX_CONCURRENCY):
+    """
+    Creates a keep-alive session whose connection pool can serve pool_size
+    concurrent requests to the same host.
+    """
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    return session
+
+
+SESSION = make_session()
+
+
+def normalize_query(origin, **kwargs):
+    """Query of a Kayak request, as a tuple of QUERY_FIELDS values."""
+    values = dict(kwargs, origin_place_id=origin)
+    return tuple('' if values.get(name) is None else str(values[name]) for name in QUERY_FIELDS)
+
+
+@lru_cache(maxsize=1024)
+def query_url(query):
+    return URL_ENDPOINT.format(d=dict(zip(QUERY_FIELDS, query)))
+
+
+def cached_response(session, query, timeout, stream=False):
+    """
+    Sends a request unless the response cache holds a fresh response to it,
+    revalidating a stale one where the server supports it.
+    :return: (cache, cache entry, response) where the response is None when
+             the cached body is to be used.
+    :raises requests.HTTPError: When the server answers with an error status.
+    """
+    cache = get_response_cache()
+    entry = cache.lookup(query) if cache is not None else None
+    if entry is not None and cache.is_fresh(entry):
+        METRICS.count('http_cache.hits')
+        return cache, entry, None
+    r = (session or SESSION).get(
+        url=query_url(query), headers=cache.conditional_headers(entry) if entry else None,
+        stream=stream, timeout=timeout
+    )
+    if r.status_code == 304 and entry is not None:
+        METRICS.count('http_cache.revalidated')
+        cache.refresh(query, entry)
+        r.close()
+        return cache, entry, None
+    METRICS.count('http_cache.misses')
+    if not r.ok:
+        r.close()
+        r.raise_for_status()
+    return cache, entry, r
+
+
+@METRICS.timed()
+def get_trips(origin, session=None, timeout=None, **kwargs):
+    query = normalize_query(origin, **kwargs)
+    cache, entry, r = cached_response(session, query, timeout)
+    if r is None:
+        with cache.open(query) as body:
+            return json.load(body)
+    r_json = r.json()
+    if cache is not None and r.status_code == 200:
+        cache.store(query, gzip.compress(r.content, compresslevel=5), r.headers)
+    return r_json
+
+
+def fetch_trips(queries: dict, max_concurrency=MAX_CONCURRENCY, session=None, timeout=None):
+    """
+    Runs get_trips for all queries in parallel over one shared session.
+    :param queries: Mapping of query name to get_trips keyword arguments.
+    :param max_concurrency: Maximum number of requests in flight.
+    :param session: Session to use instead of the module-level one.
+    :param timeout: Optional seconds after which TimeoutError is raised
+                    instead of waiting for the remaining responses.
+    :return: Mapping of query name to response, in the order of queries.
+    """
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        futures = {
+            name: executor.submit(get_trips, session=session, **kwargs)
+            for name, kwargs in queries.items()
+        }
+        _, pending = wait(futures.values(), timeout=timeout)
+        if pending:
+            raise TimeoutError(f'budget of {timeout} s exceeded')
+        return {name: future.result() for name, future in futures.items()}
+    finally:
+        # requests still in flight end on their own timeout
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_trips(origin, session=None, timeout=None, **kwargs):
+    """
+    Yields the destinations of a Kayak response while the compressed body is
+    still being downloaded, so the decoded response is never held in memory
+    as a whole. Responses are read from and written to the response cache
+    the same way. Falls back to get_trips when ijson is not installed.
+    """
+    if ijson is None:
+        yield from get_trips(origin, session=session, timeout=timeout, **kwargs)['destinations']
+        return
+    query = normalize_query(origin, **kwargs)
+    # includes the time the consumer spends on the yielded trips
+    with METRICS.timer('iter_trips'):
+        cache, entry, r = cached_response(session, query, timeout, stream=True)
+        if r is None:
+            with cache.open(query) as body:
+                yield from ijson.items(body, 'destinations.item', use_float=True)
+            return
+        with r:
+            r.raw.decode_content = True
+            if cache is None or r.status_code != 200:
+                yield from ijson.items(r.raw, 'destinations.item', use_float=True)
+                return
+            body = TeeReader(r.raw)
+            yield from ijson.items(body, 'destinations.item', use_float=True)
+            cache.store(query, body.gzipped(), r.headers)
+
+
+def stream_trips(queries: dict, max_concurrency=MAX_CONCURRENCY, session=None, chunk_size=CHUNK_SIZE,
+                 timeout=None):
+    """
+    Streams the destinations of all queries, fetched and parsed in parallel.
+    Workers hand over chunks through a bounded queue, so only a few chunks
+    are in memory at any time. Closing the generator stops the workers:
+    queries not started yet are cancelled and running ones close their
+    responses at the next trip instead of reading them to the end, without
+    the generator waiting for them.
+    :param queries: Mapping of query name to get_trips keyword arguments.
+    :param max_concurrency: Maximum number of requests in flight.
+    :param session: Session to use instead of the module-level one.
+    :param chunk_size: Number of destinations per chunk.
+    :param timeout: Optional seconds after which TimeoutError is raised
+                    instead of waiting for further chunks.
+    :return: Generator of (query name, list of destinations) pairs.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    chunks = queue.Queue(maxsize=2 * max_concurrency)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                chunks.put(entry, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def worker(name, kwargs):
+        trips = iter_trips(session=session, **kwargs)
+        try:
+            chunk = []
+            for trip in trips:
+                if stop.is_set():
+                    return
+                chunk.append(trip)
+                if len(chunk) == chunk_size:
+                    put((name, chunk))
+                    chunk = []
+            if chunk:
+                put((name, chunk))
+        except Exception as err:
+            put((name, err))
+        finally:
+            # closes the response, or skips the request of a stopped worker
+            trips.close()
+            put(done)
+
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    for name, kwargs in queries.items():
+        executor.submit(worker, name, kwargs)
+    remaining = len(queries)
+    try:
+        while remaining:
+            try:
+                entry = chunks.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise TimeoutError(f'budget of {timeout} s exceeded') from None
+            if entry is done:
+                remaining -= 1
+                continue
+            name, chunk = entry
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield name, chunk
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,75 @@
+import datetime as dt
+from sys import intern
+from collections import namedtuple
+
+Collection = namedtuple('Collection', ['sort_key', 'date'])
+
+
+def collection_for(day: dt.date):
+    """Sort key and date of the snapshots collected on a day, shared by all of a run's flights."""
+    return Collection(f'cid_{day:%Y%m%d}', f'{day:%Y-%m-%d}')
+
+
+class Flight:
+    """
+    Price snapshot of a route parsed from a Kayak response. Names shared by
+    many trips are interned and DynamoDB items are only built when written.
+    """
+    __slots__ = (
+        'flight_id', 'origin', 'destination', 'city', 'country',
+        'departure_date', 'return_date', 'price', 'days', 'collection'
+    )
+
+    def __init__(self, flight_id, origin, destination, city, country,
+                 departure_date, return_date, price, days, collection):
+        self.flight_id = flight_id
+        self.origin = origin
+        self.destination = destination
+        self.city = city
+        self.country = country
+        self.departure_date = departure_date
+        self.return_date = return_date
+        self.price = price
+        self.days = days
+        self.collection = collection
+
+    @classmethod
+    def from_trip(cls, trip, trip_type, collection):
+        origin = intern(trip['originAirportShortName'])
+        destination = intern(trip['airport']['shortName'])
+        return cls(
+            f'{origin}-{destination}-{trip_type}', origin, destination,
+            intern(trip['city']['name']), intern(trip['country']['name']),
+            intern(trip['departd']), intern(trip['returnd']),
+            trip['flightInfo']['price'], trip['days'], collection
+        )
+
+    @property
+    def sort_key(self):
+        return self.collection.sort_key
+
+    @property
+    def route_details(self):
+        return {
+            'FlightID': self.flight_id,
+            'SortKey': 'details',
+            'origin_place_id': self.origin,
+            'destination_place_id': self.destination,
+            'destination_city': self.city,
+            'destination_country': self.country
+        }
+
+    @property
+    def flight_details(self):
+        return {
+            'FlightID': self.flight_id,
+            'SortKey': self.collection.sort_key,
+            'collection_date': self.collection.date,
+            'departure_date': self.departure_date,
+            'return_date': self.return_date,
+            'price': self.price,
+            'days': self.days
+        }
+
+    def __repr__(self):
+        return f'Flight({self.flight_id}, {self.collection.sort_key}, {self.price})'
@@ -0,0 +1,166 @@
+import os
+import gzip
+import json
+import time
+import zlib
+import hashlib
+import logging
+import tempfile
+from datetime import date
+from pathlib import Path
+
+CACHE_DIR = os.environ.get('HTTP_CACHE_DIR', '/tmp/kayak-cache')
+CACHE_TTL = int(os.environ.get('HTTP_CACHE_TTL', 6 * 3600))
+CACHE_MAX_AGE = int(os.environ.get('HTTP_CACHE_MAX_AGE', 3 * 24 * 3600))
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Response bodies stored gzipped on local disk, keyed by a normalized
+    query. Entries younger than ttl and fetched on the same day are served
+    without a request, so a run never takes the prices of the previous
+    collection date for its own; older ones are revalidated with If-None-Match/If-Modified-Since when the server
+    sent an ETag or Last-Modified, and removed by evict() after max_age.
+    Each entry is a body file and a metadata file, both replaced atomically.
+    """
+
+    def __init__(self, directory=CACHE_DIR, ttl=CACHE_TTL, max_age=CACHE_MAX_AGE, clock=time.time):
+        """
+        :param directory: Directory of the entries, e.g. under /tmp.
+        :param ttl: Seconds an entry is served without revalidation.
+        :param max_age: Seconds after which evict() removes an entry.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_age = max_age
+        self.clock = clock
+
+    def _paths(self, query):
+        key = hashlib.sha1(repr(query).encode()).hexdigest()
+        return self.directory / f'{key}.json.gz', self.directory / f'{key}.meta'
+
+    def _replace(self, path, write):
+        """Writes a file under a temporary name and moves it into place."""
+        fd, partial = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                write(file)
+            os.replace(partial, path)
+        except BaseException:
+            os.unlink(partial)
+            raise
+
+    def lookup(self, query):
+        """
+        :return: Metadata of the query's entry or None when there is none.
+        """
+        body, meta = self._paths(query)
+        try:
+            with open(meta) as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return entry if body.exists() else None
+
+    def is_fresh(self, entry):
+        now = self.clock()
+        fetched_at = entry['fetched_at']
+        return now - fetched_at < self.ttl and date.fromtimestamp(fetched_at) == date.fromtimestamp(now)
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Request headers revalidating an entry, empty when it cannot be revalidated."""
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def open(self, query):
+        """Opens the decompressed body of the query's entry."""
+        return gzip.open(self._paths(query)[0], 'rb')
+
+    def _write_meta(self, query, entry):
+        self._replace(self._paths(query)[1], lambda file: file.write(json.dumps(entry).encode()))
+
+    def store(self, query, body, headers):
+        """
+        Stores a response body.
+        :param body: Gzipped body.
+        :param headers: Response headers.
+        """
+        self._replace(self._paths(query)[0], lambda file: file.write(body))
+        self._write_meta(query, {
+            'fetched_at': self.clock(),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+        })
+
+    def refresh(self, query, entry):
+        """Marks an entry the server confirmed as not modified as fetched now."""
+        self._write_meta(query, {**entry, 'fetched_at': self.clock()})
+
+    def evict(self):
+        """
+        Removes entries older than max_age and abandoned partial files.
+        :return: Number of entries removed.
+        """
+        now = self.clock()
+        removed = 0
+        for path in self.directory.glob('*.meta'):
+            try:
+                with open(path) as file:
+                    fetched_at = json.load(file)['fetched_at']
+            except (OSError, ValueError, KeyError):
+                fetched_at = 0
+            if now - fetched_at > self.max_age:
+                path.with_suffix('.json.gz').unlink(missing_ok=True)
+                path.unlink(missing_ok=True)
+                removed += 1
+        for path in self.directory.glob('*.tmp'):
+            if now - path.stat().st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+        if removed:
+            logger.info('Evicted %d cached responses', removed)
+        return removed
+
+
+class TeeReader:
+    """
+    File-like wrapper of a response body that gzips everything read through
+    it, so a streamed response can be cached without holding it decoded.
+    """
+
+    def __init__(self, raw, compresslevel=5):
+        self.raw = raw
+        self.compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+        self.parts = []
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        if data:
+            self.parts.append(self.compressor.compress(data))
+        return data
+
+    def gzipped(self):
+        """Reads the rest of the body and returns all of it gzipped."""
+        while self.read(65536):
+            pass
+        return b''.join(self.parts) + self.compressor.flush()
+
+
+_cache = None
+
+
+def get_response_cache():
+    """
+    Returns the cache, creating it once per execution environment, or None
+    when caching is turned off with an empty HTTP_CACHE_DIR.
+    """
+    global _cache
+    if _cache is None and CACHE_DIR:
+        _cache = ResponseCache()
+    return _cache
@@ -1,91 +1,168 @@
 import os
+import json
+import time
 import boto3
 import logging
 import requests
 import datetime as dt
-from collections import defaultdict, namedtuple
-from .table import FlightsTable
-from .utils import is_long
+from concurrent.futures import ThreadPoolExecutor
+from flights_common.metrics import METRICS
+from flights_common.ratelimit import AdaptiveRateLimiter
+from flights_common.table import FlightsTable
+from .airports import get_airport_cache
+from .fetch import MAX_CONCURRENCY, PARSE_ERRORS, fetch_trips, stream_trips
+from .flight import Flight, collection_for
+from .httpcache import get_response_cache
+from .pipeline import WritePipeline
+from .utils import is_long, origin_coordinates_map
 
 
-HEADERS = {
-    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-    'Accept-Encoding': 'gzip, deflate',
-    'Accept-Language': 'pl,en-US;q=0.7,en;q=0.3',
-    'Connection': 'keep-alive',
-    'Host': 'www.kayak.pl',
-    'Sec-Fetch-Dest': 'document',
-    'Sec-Fetch-Mode': 'navigate',
-    'Sec-Fetch-Site': 'none',
-    'Sec-Fetch-User': '?1',
-    'TE': 'trailers',
-    'Upgrade-Insecure-Requests': '1',
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:106.0) Gecko/20100101 Firefox/106.0',
-}
-URL_ENDPOINT = 'https://www.kayak.pl/s/horizon/exploreapi/destinations?'\
-    'airport={d[origin_place_id]}&'\
-    'budget={d[budget]}&'\
-    'tripdurationrange={d[days_range]}&'\
-    'duration=&'\
-    'flightMaxStops={d[max_stops]}&'\
-    'stopsFilterActive=false&topRightLat=80&topRightLon=180&bottomLeftLat=-65&bottomLeftLon=-180&zoomLevel=1&'\
-    'selectedMarker=&themeCode={d[theme]}&selectedDestination='
-TODAY = dt.datetime.today()
+DAYS_RANGES = {'BREAK': '2,4', 'WEEK': '5,8', 'LONG': '9,13'}
+ORIGIN_BUDGET = 120
+# 'delta' writes snapshots only when a route's price or dates changed; it
+# saves capacity while fewer than table.DELTA_BREAK_EVEN of them change a day.
+# Readers count days a route was missing at its last price, see
+# snapshots.MAX_CARRIED_DAYS
+WRITE_MODE = os.environ.get('WRITE_MODE', 'full')
+RATE_LIMITER = AdaptiveRateLimiter()
+TABLE = None
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-Flight = namedtuple('Flight', ['route_details', 'flight_details'])
 dyn_resource = boto3.resource(
     'dynamodb'
 )
 
 
-def get_trips(origin, **kwargs):
-    url = URL_ENDPOINT.format(d=defaultdict(str, origin_place_id=origin, **kwargs))
-    r = requests.get(url=url, headers=HEADERS)
-    r_json = r.json()
-    return r_json
-
-
-def parse_trip(trip, trip_type):
-    key = f"{trip['originAirportShortName']}-{trip['airport']['shortName']}-{trip_type}"
+def parse_trip(trip, trip_type, long_trip=None, collection=None):
     if trip['days'] == 0 or trip['flightInfo']['price'] > 20000:
         return 
-    if trip_type in ['BREAK', 'WEEK'] and is_long(trip):
+    if trip_type in ['BREAK', 'WEEK'] and (is_long(trip) if long_trip is None else long_trip):
         return
-    route_details = {
-        'FlightID': key,
-        'SortKey': 'details',
-        'origin_place_id': trip['originAirportShortName'],
-        'destination_place_id': trip['airport']['shortName'],
-        'destination_city': trip['city']['name'],
-        'destination_country': trip['country']['name']
-    }
-    flight_details = {
-        'FlightID': key,
-        'SortKey': f'cid_{TODAY.strftime("%Y%m%d")}',
-        'collection_date': TODAY.strftime('%Y-%m-%d'),
-        'departure_date': trip['departd'],
-        'return_date': trip['returnd'],
-        'price': trip['flightInfo']['price'],
-        'days': trip['days']
+    return Flight.from_trip(trip, trip_type, collection or collection_for(dt.date.today()))
+
+
+def process_origin(origin, table, airports, collection, budget, stream=False,
+                   max_concurrency=len(DAYS_RANGES), deadline=None):
+    """
+    Fetches, parses and writes the trips of a single origin. Requests and
+    parsing stop once the origin's time budget runs out; whatever was
+    parsed by then is still written.
+    :param budget: Seconds the origin may spend before writing. Origins
+                   without a positive budget are skipped.
+    :param max_concurrency: Maximum number of the origin's requests in flight.
+    :param deadline: Optional time.monotonic() by which every origin of the
+                     invocation has to stop fetching; the budget is cut to it
+                     when the origin starts.
+    :return: Write stats of the origin with its status.
+    """
+    pipeline = WritePipeline(table)
+    if deadline is not None:
+        budget = min(budget, deadline - time.monotonic())
+    if budget <= 0:
+        logger.warning('Skipped %s: no time left to fetch it', origin)
+        METRICS.count('origins.skipped')
+        return {**pipeline.flush(), 'status': 'skipped'}
+    deadline = time.monotonic() + budget
+    queries = {
+        trip_type: {'origin': origin, 'days_range': days_range, 'timeout': budget}
+        for trip_type, days_range in DAYS_RANGES.items()
     }
-    return Flight(route_details, flight_details)
+    status = 'ok'
+    chunks = None
+    try:
+        if stream:
+            chunks = stream_trips(queries, max_concurrency=max_concurrency, timeout=budget)
+        else:
+            responses = fetch_trips(queries, max_concurrency=max_concurrency, timeout=budget)
+            chunks = ((name, trips['destinations']) for name, trips in responses.items())
+        for trip_type, destinations in chunks:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'budget of {budget} s exceeded')
+            start = time.perf_counter()
+            airports.add_destinations(destinations)
+            for trip in destinations:
+                long_trip = airports.is_long(trip['originAirportShortName'], trip['airport']['shortName'])
+                parsed_trip = parse_trip(trip, trip_type, long_trip, collection)
+                if parsed_trip is not None:
+                    pipeline.add(parsed_trip)
+            # one timing per chunk, timing every trip would cost more than parsing it
+            METRICS.add_time('parse_trip', time.perf_counter() - start, calls=len(destinations))
+    except (requests.RequestException, TimeoutError, *PARSE_ERRORS) as err:
+        logger.warning('Stopped fetching %s: %s', origin, err)
+        status = 'timeout' if isinstance(err, (requests.Timeout, TimeoutError)) else 'error'
+    finally:
+        if chunks is not None:
+            # stops the stream's workers now rather than when garbage collected
+            chunks.close()
+    METRICS.count(f'origins.{status}')
+    return {**pipeline.flush(), 'status': status}
+
+
+def get_table():
+    """
+    Returns the flights table or None when it does not exist. The table is
+    only loaded once per execution environment.
+    """
+    global TABLE
+    if TABLE is None:
+        table = FlightsTable(
+            dyn_resource, known_routes=get_airport_cache().routes, rate_limiter=RATE_LIMITER,
+            delta_writes=WRITE_MODE == 'delta'
+        )
+        if table.exists():
+            TABLE = table
+    return TABLE
 
 
 def lambda_handler(event, context):
-    origin = event['origin']
-    days_ranges = {'BREAK': '2,4', 'WEEK': '5,8', 'LONG': '9,13'}
-    table = FlightsTable(dyn_resource)
-    if table.exists():
-        trips_parsed = []
-        for trip_type, days_range in days_ranges.items():
-            trips = get_trips(origin=origin, days_range=days_range)
-            for trip in trips['destinations']:
-                parsed_trip = parse_trip(trip, trip_type) 
-                if parsed_trip is not None:
-                    trips_parsed.append(parsed_trip)
-            r = table.write_batch(trips_parsed)
-    return {
-        'statusCode': 200,
-        'body': r
-    }
+    """
+    Collects prices for event['origin'], a list of event['origins'] or, with
+    origins set to 'all', every origin in origin_coordinates_map. Origins are
+    processed in parallel over one table handle and one HTTP pool, each
+    within its own time budget and all of them before a deadline leaving
+    time for the last writes. Apart from requests abandoned at a timeout,
+    which end on their own, at most max_concurrency requests are in flight,
+    one per trip type and origin when it allows.
+    """
+    try:
+        origins = event.get('origins') or [event['origin']]
+        if origins == 'all':
+            origins = list(origin_coordinates_map)
+        max_concurrency = event.get('max_concurrency', MAX_CONCURRENCY)
+        budget = event.get('origin_budget', ORIGIN_BUDGET)
+        deadline = None
+        if context is not None:
+            # leave time for the last writes before the function times out,
+            # origins queued behind others only get what is left of it
+            deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - 15
+        airports = get_airport_cache()
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            response_cache.evict()
+        table = get_table()
+        stats = {}
+        if table is not None:
+            collection = collection_for(dt.date.today())
+            workers = max(1, min(len(origins), max_concurrency // len(DAYS_RANGES)))
+            origin_concurrency = max(1, min(len(DAYS_RANGES), max_concurrency // workers))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    origin: executor.submit(
+                        process_origin, origin, table, airports, collection, budget, event.get('stream', False),
+                        origin_concurrency, deadline
+                    )
+                    for origin in origins
+                }
+                origin_stats = {origin: future.result() for origin, future in futures.items()}
+            airports.save_routes()
+            stats = {
+                key: sum(result[key] for result in origin_stats.values())
+                for key in ('written', 'skipped', 'unchanged', 'retried')
+            }
+            stats['origins'] = origin_stats
+        return {
+            'statusCode': 200,
+            'body': json.dumps(stats)
+        }
+    finally:
+        METRICS.flush(Function='flights-download')
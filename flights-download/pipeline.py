@@ -0,0 +1,49 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WritePipeline:
+    """
+    Collects the flights parsed during a run and writes every unique
+    (FlightID, SortKey) snapshot once, on flush.
+    """
+
+    def __init__(self, table):
+        """
+        :param table: FlightsTable to write to.
+        """
+        self.table = table
+        self.pending = {}
+        self.seen = set()
+        self.written = 0
+        self.skipped = 0
+        self.unchanged = 0
+        self.retried = 0
+
+    def add(self, flight):
+        key = (flight.flight_id, flight.sort_key)
+        if key in self.seen:
+            self.skipped += 1
+            return
+        self.seen.add(key)
+        self.pending[key] = flight
+
+    def flush(self):
+        """
+        Writes all pending flights. Flights added again after a flush are
+        skipped, so flushing more than once never writes a snapshot twice.
+        :return: Counts of items written, skipped as duplicates, skipped as
+                 unchanged by delta writes and retried.
+        """
+        if self.pending:
+            result = self.table.write_batch(list(self.pending.values()))
+            self.written += result['written']
+            self.unchanged += result['unchanged']
+            self.retried += result['retried']
+            self.pending = {}
+        stats = {
+            'written': self.written, 'skipped': self.skipped, 'unchanged': self.unchanged, 'retried': self.retried
+        }
+        logger.info('Write pipeline: %s', stats)
+        return stats
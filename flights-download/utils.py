@@ -4,12 +4,14 @@ origin_coordinates_map = {
     'KRK': {'lon': 20.96712, 'lat': 52.16575, 'limit': 4000},
     'WAW': {'lon': 19.79157, 'lat': 50.07617, 'limit': 4000}
 }
+EARTH_RADIUS = 6373.0
+ORIGIN_INDEX = {origin: i for i, origin in enumerate(origin_coordinates_map)}
+ORIGIN_LAT = tuple(radians(coords['lat']) for coords in origin_coordinates_map.values())
+ORIGIN_LON = tuple(radians(coords['lon']) for coords in origin_coordinates_map.values())
 
 def distance(origin, destination_lat, destination_lon):
-    earth_radius = 6373.0
-
-    lat1 = radians(origin_coordinates_map[origin]['lat'])
-    lon1 = radians(origin_coordinates_map[origin]['lon'])
+    lat1 = ORIGIN_LAT[ORIGIN_INDEX[origin]]
+    lon1 = ORIGIN_LON[ORIGIN_INDEX[origin]]
     lat2 = radians(destination_lat)
     lon2 = radians(destination_lon)
 
@@ -18,7 +20,7 @@ def distance(origin, destination_lat, destination_lon):
 
     a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
     c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    return earth_radius * c
+    return EARTH_RADIUS * c
 
 def is_long(trip):
     origin = trip['originAirportShortName']
@@ -29,3 +31,22 @@ def is_long(trip):
     ) > origin_coordinates_map[origin]['limit']:
         return True
     return False
+
+def distances(origin_idx, destination_lat, destination_lon):
+    """
+    Haversine distances computed in a single NumPy pass.
+    :param origin_idx: Array of ORIGIN_INDEX values, one per trip.
+    :param destination_lat: Array of destination latitudes in degrees.
+    :param destination_lon: Array of destination longitudes in degrees.
+    :return: Array of distances in km.
+    """
+    import numpy as np
+
+    lat1 = np.asarray(ORIGIN_LAT)[origin_idx]
+    lat2 = np.radians(destination_lat)
+    dlat = lat2 - lat1
+    dlon = np.radians(destination_lon) - np.asarray(ORIGIN_LON)[origin_idx]
+
+    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS * c
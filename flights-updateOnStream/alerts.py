@@ -0,0 +1,83 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from .sketch import bucket
+
+ALERT_TTL_DAYS = int(os.environ.get('ALERT_TTL_DAYS', 7))
+
+
+def alert_key(flight_id, departure_date, return_date, price):
+    """Alerts are deduplicated per route, dates and price bucket."""
+    return flight_id, f'alert_{departure_date}_{return_date}_{bucket(price)}'
+
+
+def record_alert_key(record):
+    new_image = record['dynamodb']['NewImage']
+    return alert_key(
+        new_image['FlightID']['S'], new_image['departure_date']['S'],
+        new_image['return_date']['S'], float(new_image['price']['N'])
+    )
+
+
+class AlertStore:
+    """
+    Alerts already sent, stored as alert_<departure>_<return>_<price bucket>
+    items in the route's partition with an expires_at attribute (the table's
+    TTL attribute). Sent alerts are also kept in a local LRU that survives
+    warm invocations, so retried batches need no reads.
+    """
+
+    def __init__(self, ttl_days=ALERT_TTL_DAYS, max_size=10000):
+        self.ttl = ttl_days * 24 * 3600
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key, expires_at):
+        with self._lock:
+            self.cache[key] = expires_at
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def _cached(self, key, now):
+        with self._lock:
+            expires_at = self.cache.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= now:
+                del self.cache[key]
+                return False
+            self.cache.move_to_end(key)
+            return True
+
+    def sent(self, table, keys):
+        """
+        Finds keys with an unexpired alert, reading the ones missing from the
+        local cache with BatchGetItem.
+        :param keys: (FlightID, SortKey) alert keys.
+        :return: Set of keys already alerted.
+        """
+        now = int(time.time())
+        keys = set(keys)
+        found = {key for key in keys if self._cached(key, now)}
+        missing = [{'FlightID': flight_id, 'SortKey': sort_key} for flight_id, sort_key in keys - found]
+        # DynamoDB deletes expired items lazily, so expires_at is checked here too
+        for item in table.batch_get_items(missing, projection='FlightID, SortKey, expires_at'):
+            if int(item['expires_at']) > now:
+                key = (item['FlightID'], item['SortKey'])
+                self._remember(key, int(item['expires_at']))
+                found.add(key)
+        return found
+
+    def mark(self, table, keys):
+        """Stores alerts for the given keys."""
+        expires_at = int(time.time()) + self.ttl
+        keys = set(keys)
+        for flight_id, sort_key in keys:
+            table.add_item({'FlightID': flight_id, 'SortKey': sort_key, 'expires_at': expires_at})
+            self._remember((flight_id, sort_key), expires_at)
+
+
+ALERTS = AlertStore()
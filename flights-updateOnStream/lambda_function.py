@@ -1,16 +1,32 @@
 import os
-import smtplib
-import ssl
 import boto3
-import time
 import logging
-import numpy as np
-from datetime import datetime 
-from email.mime.text import MIMEText 
-from email.mime.multipart import MIMEMultipart 
-from .table import FlightsTable
-from .utils import origin_map, is_new_flight, flight_to_text
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from operator import itemgetter
+from flights_common.baselines import baseline_sort_key, season_number
+from flights_common.metrics import METRICS
+from flights_common.ratelimit import AdaptiveRateLimiter
+from flights_common.snapshots import daily_prices, unchanged_days
+from flights_common.table import FlightsTable
+from .alerts import ALERTS, alert_key, record_alert_key
+from .notify import send_email
+from .sketch import PriceSketch, bucket
+from .stats import percentile
+from .utils import is_new_flight
 
+STATS_MODE = os.environ.get('STATS_MODE', 'sketch')
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 8))
+HISTORY_DAYS = int(os.environ.get('HISTORY_DAYS', 0))
+BASELINE_SEASONALITY = os.environ.get('BASELINE_SEASONALITY') or None
+# days after which a baseline the nightly job stopped recomputing is ignored
+BASELINE_MAX_AGE = int(os.environ.get('BASELINE_MAX_AGE', 1))
+PRICE_NUMBER_LIMIT = 15
+PERCENTILES = [1, 5]
+LEVELS = [2, 1]
+RATE_LIMITER = AdaptiveRateLimiter()
+TABLE = None
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 dyn_resource = boto3.resource(
@@ -21,98 +37,238 @@ dyn_resource = boto3.resource(
 )
 
 
-def send_email(flights):
-    sender_email = os.environ.get('GMAIL_FROM')
-    receiver_email = os.environ.get('GMAIL_TO').split(',')
-    title_origin = origin_map[flights[0]['flight_info']['origin_place_id']]
-    date = datetime.today().date().isoformat()
-    password = os.environ.get('GMAIL_PASSWORD')
-    
-    message = MIMEMultipart("alternative") 
-    message["Subject"] = f"Tanie loty {title_origin} - {date}" 
-    message["From"] = sender_email
-    short_Flights = '<br>'.join([flight_to_text(flight) for flight in flights if 'BREAK' in flight['flight_id']])
-    week_flights = '<br>'.join([flight_to_text(flight) for flight in flights if 'WEEK' in flight['flight_id']])
-    long_flights = '<br>'.join([flight_to_text(flight) for flight in flights if 'LONG' in flight['flight_id']])
-    short_flights_text = f"<b>KRÓTKIE (3 - 5 dni):</b><br>{short_Flights}<br><br>"
-    week_flights_text = f"<b>TYGODNIOWE (6 - 9 dni):</b><br>{week_flights}<br><br>"
-    long_flights_text = f"<b>DŁUGIE (10 - 13 dni):</b><br>{long_flights}"
-    flights_text = ''
-    if short_Flights:
-        flights_text += short_flights_text
-    if week_flights:
-        flights_text += week_flights_text
-    if long_flights:
-        flights_text += long_flights_text
-    if not flights_text:
-        return
-    html = f"""
-    <html> 
-        <body>
-            <p>{flights_text}</p>
-        </body> 
-    </html> 
-    """ 
-    message_body = MIMEText(html, "html") 
-    message.attach(message_body) 
-    context = ssl.create_default_context() 
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server: 
-        server.login(sender_email, password) 
-        server.sendmail( 
-            sender_email, receiver_email, message.as_string()
-        )
+def history_stats(table, flight_id):
+    """
+    Computes price stats from the route's price history, limited to the last
+    HISTORY_DAYS days when set. Days skipped by delta writes count with the
+    price the route had on them.
+    """
+    since = None
+    if HISTORY_DAYS:
+        since = (datetime.today() - timedelta(days=HISTORY_DAYS)).strftime('%Y%m%d')
+    prices = daily_prices(table.query_prices(flight_id, since=since), since)
+    if not prices:
+        return 0, None, [], None
+    with METRICS.timer('percentile'):
+        median_price, *thresholds = percentile(prices, [50] + PERCENTILES)
+    return len(prices), median_price, thresholds, None
 
 
-def lambda_handler(event, context):
-    i = 0
-    table = FlightsTable(dyn_resource)
-    cheap_flights = []
-    price_number_limit = 15
-    percentiles = [1, 5]
-    levels = [2, 1]
-    if table.exists():
-        records = event['Records']
-        for record in records:
-            if not is_new_flight(record):
-                continue
-            i += 1
-            flight_id = record['dynamodb']['Keys']['FlightID']['S']
-            response = table.query_items('FlightID', flight_id)
-            flight_info = [item for item in response if 'details' in item['SortKey']][0]
-            prices = [float(item['price']) for item in response if 'cid' in item['SortKey']]
-            if len(prices) < price_number_limit:
-                continue
-
-            new_price = float(record['dynamodb']['NewImage']['price']['N'])
-            median_price = np.median(prices)
-            flight_details = {
-                'price': new_price,
-                'days': record['dynamodb']['NewImage']['days']['N'],
-                'departure_date': record['dynamodb']['NewImage']['departure_date']['S'],
-                'return_date': record['dynamodb']['NewImage']['return_date']['S']
-            }
-            cheap_flight = {
-                'flight_id': flight_id,
-                'flight_info': flight_info, 
-                'flight_details': flight_details,
-                'median_price': median_price
-            }
-            thresholds = list(np.percentile(prices, percentiles))
-            for threshold, level in zip(thresholds, levels):
-                if new_price < threshold:
-                    cheap_flights.append({
-                        'level': level,
-                        **cheap_flight
-                    })
-                    break
-            time.sleep(0.15)
-
-    logger.info('Checked %d items', i)
-    if cheap_flights:
-        logger.info('Sending mail')
-        send_email(cheap_flights)
-    
-    logger.info('Done')
+def sketch_stats(table, flight_id, record):
+    """
+    Adds the new price to the route's price sketch and computes price stats
+    from it. The full history is only read once, to seed routes collected
+    before the sketch was introduced. The previous price of a delta-written
+    snapshot is added once for every day it skipped.
+    """
+    image = record['dynamodb']['NewImage']
+    sort_key = image['SortKey']['S']
+    new_price = float(image['price']['N'])
+    carried = None
+    if 'previous_cid' in image:
+        days = unchanged_days({'SortKey': sort_key, 'previous_cid': image['previous_cid']['S']})
+        previous_price = float(image['previous_price']['N'])
+        carried = (previous_price, bucket(previous_price), days) if days else None
+    agg = table.update_price_stats(flight_id, sort_key, new_price, bucket(new_price), carried)
+    if agg is None:
+        prices = daily_prices(table.query_prices(flight_id))
+        sketch = PriceSketch()
+        for price in prices:
+            sketch.add(price)
+        agg = table.seed_price_stats(flight_id, sort_key, prices, sketch.to_item())
+    sketch = PriceSketch.from_item(agg)
+    if not sketch.count:
+        return 0, None, [], None
+    with METRICS.timer('percentile'):
+        median_price, *thresholds = sketch.percentile([50] + PERCENTILES)
+    return int(agg['count_total']), median_price, thresholds, None
+
+
+def baseline_keys(flight_id, record):
+    """Sort keys of the baselines a record is compared against, most specific first."""
+    if BASELINE_SEASONALITY is None:
+        return ['baseline']
+    departure_date = record['dynamodb']['NewImage']['departure_date']['S']
+    return [
+        baseline_sort_key(BASELINE_SEASONALITY, season_number(BASELINE_SEASONALITY, departure_date)),
+        'baseline'
+    ]
+
+
+def load_baselines(table, routes):
+    """
+    Reads the precomputed baselines of all records in one BatchGetItem.
+    :param routes: Mapping of FlightID to (position in batch, record) pairs.
+    :return: Baseline items keyed by (FlightID, SortKey).
+    """
+    keys = {
+        (flight_id, sort_key)
+        for flight_id, records in routes.items()
+        for _, record in records
+        for sort_key in baseline_keys(flight_id, record)
+    }
+    items = table.batch_get_items([{'FlightID': flight_id, 'SortKey': sort_key} for flight_id, sort_key in keys])
+    return {(item['FlightID'], item['SortKey']): item for item in items}
+
+
+def baseline_stats(baselines, flight_id, record):
+    """
+    Price stats of the record's precomputed baseline. Seasonal baselines
+    with too few prices give way to the route's overall baseline. Baselines
+    computed more than BASELINE_MAX_AGE days ago are ignored: the job only
+    writes the groups it computed, so those of seasons that dropped below
+    its MIN_SEASON_COUNT or routes that left its window keep their old values.
+    :return: Price stats or None when the route has no current baseline.
+    """
+    oldest = (datetime.today() - timedelta(days=BASELINE_MAX_AGE)).strftime('%Y%m%d')
+    for sort_key in baseline_keys(flight_id, record):
+        item = baselines.get((flight_id, sort_key))
+        if item is None or item['computed_at'] < oldest:
+            continue
+        if int(item['count']) >= PRICE_NUMBER_LIMIT or sort_key == 'baseline':
+            thresholds = [float(item['percentiles'][str(p)]) for p in PERCENTILES]
+            return int(item['count']), float(item['median']), thresholds, None
+    return None
+
+
+def is_below(price, threshold):
+    """
+    Whether a price is below a threshold. Sketch thresholds are only known
+    to the precision of their bucket, whose midpoint can lie above every
+    price seen, so in sketch mode the price's bucket has to be lower.
+    """
+    if STATS_MODE == 'sketch':
+        return bucket(price) < bucket(threshold)
+    return price < threshold
+
+
+def check_flight(table, flight_id, record, stats):
+    """
+    Compares the new price against the route's thresholds.
+    :return: Cheap flight data or None when the price is not low enough.
+    """
+    count, median_price, thresholds, flight_info = stats
+    if count < PRICE_NUMBER_LIMIT:
+        return None
+    new_price = float(record['dynamodb']['NewImage']['price']['N'])
+    for threshold, level in zip(thresholds, LEVELS):
+        if is_below(new_price, threshold):
+            break
+    else:
+        return None
+    if flight_info is None:
+        flight_info = table.get_item({'FlightID': flight_id, 'SortKey': 'details'})['Item']
+    flight_details = {
+        'price': new_price,
+        'days': record['dynamodb']['NewImage']['days']['N'],
+        'departure_date': record['dynamodb']['NewImage']['departure_date']['S'],
+        'return_date': record['dynamodb']['NewImage']['return_date']['S']
+    }
     return {
-        'statusCode': 200,
-    } 
+        'level': level,
+        'flight_id': flight_id,
+        'flight_info': flight_info, 
+        'flight_details': flight_details,
+        'median_price': median_price
+    }
+
+
+def process_route(table, flight_id, records, alerted, baselines=None):
+    """
+    Checks all new records of a single route. In history mode the history is
+    fetched once and shared by the records; in sketch mode the records are
+    added to the sketch oldest first; in baseline mode the records are
+    compared against the precomputed baselines, falling back to the history
+    for routes without one. Records already alerted are not checked, though
+    in sketch mode their prices are still added to the sketch.
+    :param records: (position in batch, record) pairs.
+    :param alerted: Alert keys of records already alerted.
+    :param baselines: Baseline items loaded by load_baselines.
+    :return: (position in batch, cheap flight or None) pairs.
+    """
+    results = []
+    if STATS_MODE == 'sketch':
+        records = sorted(records, key=lambda pair: pair[1]['dynamodb']['NewImage']['SortKey']['S'])
+        for position, record in records:
+            stats = sketch_stats(table, flight_id, record)
+            if record_alert_key(record) not in alerted:
+                results.append((position, check_flight(table, flight_id, record, stats)))
+        return results
+    records = [(position, record) for position, record in records if record_alert_key(record) not in alerted]
+    if STATS_MODE == 'baseline':
+        history = None
+        for position, record in records:
+            stats = baseline_stats(baselines, flight_id, record)
+            if stats is None:
+                if history is None:
+                    history = history_stats(table, flight_id)
+                stats = history
+            results.append((position, check_flight(table, flight_id, record, stats)))
+        return results
+    if records:
+        stats = history_stats(table, flight_id)
+        results = [(position, check_flight(table, flight_id, record, stats)) for position, record in records]
+    return results
+
+
+def get_table():
+    """
+    Returns the flights table or None when it does not exist. The table is
+    only loaded once per execution environment.
+    """
+    global TABLE
+    if TABLE is None:
+        table = FlightsTable(dyn_resource, rate_limiter=RATE_LIMITER)
+        if table.exists():
+            TABLE = table
+    return TABLE
+
+
+def lambda_handler(event, context):
+    try:
+        table = get_table()
+        cheap_flights = []
+        routes = defaultdict(list)
+        if table is not None:
+            for position, record in enumerate(event['Records']):
+                if is_new_flight(record):
+                    routes[record['dynamodb']['Keys']['FlightID']['S']].append((position, record))
+            alerted = ALERTS.sent(
+                table, [record_alert_key(record) for records in routes.values() for _, record in records]
+            )
+            logger.info('Found %d alerts already sent', len(alerted))
+            baselines = load_baselines(table, routes) if STATS_MODE == 'baseline' else None
+            # boto3 resources are not thread safe to create, but the loaded table
+            # only delegates to its client, which is
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                futures = [
+                    executor.submit(process_route, table, flight_id, records, alerted, baselines)
+                    for flight_id, records in routes.items()
+                ]
+                results = sorted(
+                    (result for future in futures for result in future.result()), key=itemgetter(0)
+                )
+            cheap_flights = [flight for _, flight in results if flight is not None]
+            METRICS.count('records', len(results))
+            METRICS.count('records.alerted', len(alerted))
+            METRICS.count('cheap_flights', len(cheap_flights))
+
+        logger.info('Checked %d items', sum(len(records) for records in routes.values()))
+        if cheap_flights:
+            logger.info('Sending mail')
+            with METRICS.timer('send_email'):
+                send_email(cheap_flights)
+            ALERTS.mark(table, [
+                alert_key(
+                    flight['flight_id'], flight['flight_details']['departure_date'],
+                    flight['flight_details']['return_date'], flight['flight_details']['price']
+                )
+                for flight in cheap_flights
+            ])
+
+        logger.info('Done')
+        return {
+            'statusCode': 200,
+        } 
+    finally:
+        METRICS.flush(Function='flights-updateOnStream')
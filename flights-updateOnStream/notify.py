@@ -0,0 +1,109 @@
+import os
+import logging
+from collections import defaultdict
+from datetime import datetime
+from string import Template
+from .utils import origin_map, flight_to_text
+
+# SMTP_HOST=localhost SMTP_PORT=1025 SMTP_SSL=0 sends to a local stand-in,
+# e.g. python -m aiosmtpd -n -l localhost:1025
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 465))
+SMTP_SSL = os.environ.get('SMTP_SSL', '1') == '1'
+SECTIONS = {
+    'BREAK': Template('<b>KRÓTKIE (3 - 5 dni):</b><br>$flights<br><br>'),
+    'WEEK': Template('<b>TYGODNIOWE (6 - 9 dni):</b><br>$flights<br><br>'),
+    'LONG': Template('<b>DŁUGIE (10 - 13 dni):</b><br>$flights'),
+}
+MESSAGE = Template("""
+    <html> 
+        <body>
+            <p>$flights_text</p>
+        </body> 
+    </html> 
+    """)
+logger = logging.getLogger(__name__)
+
+
+class Mailer:
+    """
+    SMTP connection opened on first use and reused for all messages, also
+    across warm invocations. A connection closed by the server in the
+    meantime is reopened once.
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, use_ssl=SMTP_SSL):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.server = None
+
+    def connect(self):
+        import ssl
+        import smtplib
+
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, context=ssl.create_default_context())
+        else:
+            server = smtplib.SMTP(self.host, self.port)
+        password = os.environ.get('GMAIL_PASSWORD')
+        if password:
+            server.login(os.environ.get('GMAIL_FROM'), password)
+        return server
+
+    def send(self, sender, receivers, message):
+        from smtplib import SMTPServerDisconnected
+
+        for attempt in range(2):
+            if self.server is None:
+                self.server = self.connect()
+            try:
+                self.server.sendmail(sender, receivers, message.as_string())
+                return
+            except SMTPServerDisconnected:
+                self.server = None
+                if attempt:
+                    raise
+
+
+MAILER = Mailer()
+
+
+def group_flights(flights):
+    """
+    Renders cheap flights grouped by origin and trip type, in a single pass.
+    :return: Mapping of origin to mapping of trip type to rendered flights.
+    """
+    groups = defaultdict(lambda: defaultdict(list))
+    for flight in flights:
+        trip_type = flight['flight_id'].rsplit('-', 1)[-1]
+        groups[flight['flight_info']['origin_place_id']][trip_type].append(flight_to_text(flight))
+    return groups
+
+
+def render(flights_by_type):
+    return ''.join(
+        template.substitute(flights='<br>'.join(flights_by_type[trip_type]))
+        for trip_type, template in SECTIONS.items() if flights_by_type.get(trip_type)
+    )
+
+
+def send_email(flights):
+    """Sends one message per origin over a single SMTP connection."""
+    # the mail modules are only needed by invocations that found cheap flights
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
+    sender_email = os.environ.get('GMAIL_FROM')
+    receiver_email = os.environ.get('GMAIL_TO').split(',')
+    date = datetime.today().date().isoformat()
+    for origin, flights_by_type in group_flights(flights).items():
+        flights_text = render(flights_by_type)
+        if not flights_text:
+            continue
+        message = MIMEMultipart("alternative") 
+        message["Subject"] = f"Tanie loty {origin_map.get(origin, origin)} - {date}" 
+        message["From"] = sender_email
+        message.attach(MIMEText(MESSAGE.substitute(flights_text=flights_text), "html"))
+        logger.info('Sending mail for %s', origin)
+        MAILER.send(sender_email, receiver_email, message)
@@ -0,0 +1,71 @@
+import math
+
+GAMMA = 1.02
+LOG_GAMMA = math.log(GAMMA)
+
+
+def bucket(price):
+    """
+    Index of the log-spaced histogram bucket holding the price. Neighbouring
+    buckets differ by GAMMA, so any price is recovered within ~1%.
+    """
+    return math.ceil(math.log(max(float(price), 1.0)) / LOG_GAMMA)
+
+
+def bucket_value(index):
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+class PriceSketch:
+    """
+    Compact quantile sketch of a route's price history, stored in the
+    route's total_agg item as a map of bucket index -> count.
+    """
+
+    def __init__(self, counts=None):
+        self.counts = {int(index): int(count) for index, count in (counts or {}).items()}
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(item.get('price_hist'))
+
+    @property
+    def count(self):
+        return sum(self.counts.values())
+
+    def add(self, price, weight=1):
+        index = bucket(price)
+        self.counts[index] = self.counts.get(index, 0) + weight
+
+    def to_item(self):
+        return {str(index): count for index, count in self.counts.items()}
+
+    def _value_at(self, rank):
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen > rank:
+                return bucket_value(index)
+        return bucket_value(max(self.counts))
+
+    def quantile(self, q):
+        """
+        Estimates the q-quantile, interpolating between ranks the same way
+        np.percentile does.
+        :param q: Quantile in range [0, 1].
+        """
+        n = self.count
+        if n == 0:
+            raise ValueError('Cannot compute a quantile of an empty sketch')
+        rank = q * (n - 1)
+        lower, upper = math.floor(rank), math.ceil(rank)
+        lower_value = self._value_at(lower)
+        if upper == lower:
+            return lower_value
+        return lower_value + (self._value_at(upper) - lower_value) * (rank - lower)
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def percentile(self, percentiles):
+        return [self.quantile(p / 100) for p in percentiles]
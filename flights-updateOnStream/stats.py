@@ -0,0 +1,26 @@
+import math
+
+# sorting in pure Python beats importing NumPy for route histories this size
+NUMPY_MIN_SIZE = 5000
+
+
+def percentile(values, percentiles):
+    """
+    Percentiles with linear interpolation, matching np.percentile. NumPy is
+    only imported for samples larger than NUMPY_MIN_SIZE.
+    :param values: Sample values.
+    :param percentiles: Percentiles in range [0, 100].
+    :return: List of values at the percentiles.
+    """
+    if len(values) > NUMPY_MIN_SIZE:
+        import numpy as np
+        return [float(value) for value in np.percentile(values, percentiles)]
+    ordered = sorted(values)
+    last = len(ordered) - 1
+    result = []
+    for p in percentiles:
+        rank = p / 100 * last
+        lower = math.floor(rank)
+        upper = min(lower + 1, last)
+        result.append(ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower))
+    return result
@@ -0,0 +1,64 @@
+import datetime as dt
+import os
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'flights-common' / 'python'))
+# the lambdas create their boto3 resources on import
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from flights_common.snapshots import is_unchanged  # noqa: E402
+
+FIRST_DAY = dt.date(2026, 8, 1)
+
+
+def make_histories(n_routes=20, days=60, change_rate=0.2, seed=0, change_last_day=True):
+    """
+    Snapshots of the same simulated routes as written every day and as
+    written by delta writes. Routes start on different days and their
+    prices and dates change at change_rate.
+    :param change_last_day: Change every route on the last day, so its last
+                            snapshot is written in both.
+    :return: Lists of full and delta-written snapshots.
+    """
+    rng = random.Random(seed)
+    full, delta = [], []
+    for n in range(n_routes):
+        flight_id = f'KTW-A{n:02d}-BREAK'
+        price = rng.randrange(150, 2000)
+        departure = FIRST_DAY + dt.timedelta(days=rng.randrange(30, 90))
+        last = None
+        for day in range(rng.randrange(days // 3), days):
+            if rng.random() < change_rate or (change_last_day and day == days - 1):
+                price = rng.randrange(150, 2000)
+                if rng.random() < 0.3:
+                    departure += dt.timedelta(days=rng.randrange(1, 30))
+            item = {
+                'FlightID': flight_id, 'SortKey': f'cid_{FIRST_DAY + dt.timedelta(days=day):%Y%m%d}',
+                'price': price, 'departure_date': f'{departure:%Y%m%d}',
+                'return_date': f'{departure + dt.timedelta(days=4):%Y%m%d}', 'days': 4,
+            }
+            full.append(item)
+            if last is not None and is_unchanged(last, price, item['departure_date'], item['return_date']):
+                continue
+            snapshot = dict(item)
+            if last is not None:
+                snapshot.update(previous_cid=last['cid'], previous_price=last['price'])
+            delta.append(snapshot)
+            last = dict(snapshot, cid=item['SortKey'])
+    return full, delta
+
+
+@pytest.fixture(scope='session')
+def histories():
+    return make_histories()
+
+
+@pytest.fixture(scope='session')
+def stable_histories():
+    return make_histories(change_last_day=False)
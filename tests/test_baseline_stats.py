@@ -0,0 +1,27 @@
+import datetime as dt
+import importlib
+
+stream = importlib.import_module('flights-updateOnStream.lambda_function')
+
+FLIGHT_ID = 'KTW-AAA-BREAK'
+RECORD = {'dynamodb': {'NewImage': {'departure_date': {'S': '20261105'}}}}
+
+
+def baseline(sort_key, days_ago, count=100, threshold=400):
+    computed_at = (dt.date.today() - dt.timedelta(days=days_ago)).strftime('%Y%m%d')
+    item = {
+        'FlightID': FLIGHT_ID, 'SortKey': sort_key, 'count': count, 'median': 500,
+        'percentiles': {str(p): threshold for p in stream.PERCENTILES}, 'computed_at': computed_at
+    }
+    return {(FLIGHT_ID, sort_key): item}
+
+
+def test_stale_seasonal_baseline_gives_way_to_the_route_baseline(monkeypatch):
+    monkeypatch.setattr(stream, 'BASELINE_SEASONALITY', 'month')
+    baselines = {**baseline('baseline_month_10', days_ago=30, threshold=300), **baseline('baseline', days_ago=0)}
+    assert stream.baseline_stats(baselines, FLIGHT_ID, RECORD) == (100, 500.0, [400.0, 400.0], None)
+
+
+def test_stale_route_baseline_is_ignored():
+    assert stream.baseline_stats(baseline('baseline', days_ago=1), FLIGHT_ID, RECORD) is not None
+    assert stream.baseline_stats(baseline('baseline', days_ago=2), FLIGHT_ID, RECORD) is None
@@ -0,0 +1,232 @@
+"""
+Every reader of delta-written snapshots has to see the prices of a table
+written every day, counted through flights_common.snapshots.
+"""
+import datetime as dt
+import importlib
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from flights_common import snapshots
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'analytics'))
+backtest = importlib.import_module('backtest')
+baseline = importlib.import_module('flights-baseline.baseline')
+baseline_job = importlib.import_module('flights-baseline.lambda_function')
+stream = importlib.import_module('flights-updateOnStream.lambda_function')
+sketch = importlib.import_module('flights-updateOnStream.sketch')
+stats = importlib.import_module('flights-updateOnStream.stats')
+
+SINCE = '20260901'
+
+
+def by_route(items):
+    routes = defaultdict(list)
+    for item in items:
+        routes[item['FlightID']].append(item)
+    return routes
+
+
+def in_window(items, since):
+    return [item for item in items if item['SortKey'] >= f'cid_{since}']
+
+
+@pytest.mark.parametrize('since', [None, SINCE])
+def test_daily_prices(histories, since):
+    full, delta = histories
+    delta_routes = by_route(in_window(delta, since) if since else delta)
+    for flight_id, items in by_route(in_window(full, since) if since else full).items():
+        expected = sorted(float(item['price']) for item in items)
+        assert sorted(snapshots.daily_prices(delta_routes[flight_id], since)) == expected, flight_id
+
+
+class SketchTable:
+    """Keeps total_agg items in memory, updated like FlightsTable.update_price_stats."""
+
+    def __init__(self):
+        self.sketches = defaultdict(sketch.PriceSketch)
+
+    def update_price_stats(self, flight_id, sort_key, price, bucket, carried=None):
+        price_sketch = self.sketches[flight_id]
+        price_sketch.counts[bucket] = price_sketch.counts.get(bucket, 0) + 1
+        if carried:
+            _, carried_bucket, days = carried
+            price_sketch.counts[carried_bucket] = price_sketch.counts.get(carried_bucket, 0) + days
+        return {'count_total': price_sketch.count, 'price_hist': price_sketch.to_item()}
+
+
+def stream_record(item):
+    image = {'SortKey': {'S': item['SortKey']}, 'price': {'N': str(item['price'])}}
+    if 'previous_cid' in item:
+        image.update(previous_cid={'S': item['previous_cid']}, previous_price={'N': str(item['previous_price'])})
+    return {'dynamodb': {'NewImage': image}}
+
+
+def test_sketch(histories):
+    full, delta = histories
+    table = SketchTable()
+    for item in sorted(delta, key=lambda item: item['SortKey']):
+        stream.sketch_stats(table, item['FlightID'], stream_record(item))
+    for flight_id, items in by_route(full).items():
+        expected = sketch.PriceSketch()
+        for item in items:
+            expected.add(item['price'])
+        assert table.sketches[flight_id].counts == expected.counts, flight_id
+
+
+def baseline_rows(items, since=None):
+    """Snapshots the baseline job reads: those of the window and, with since, the previous ones they name."""
+    columns = baseline.PriceColumns(since)
+    for item in in_window(items, since) if since else items:
+        columns.add(item)
+    keys = {(item['FlightID'], item['SortKey']): item for item in items}
+    for key in columns.previous_keys():
+        columns.add(keys[key['FlightID'], key['SortKey']])
+    routes, prices, departures = columns.arrays()
+    names = list(columns.route_codes)
+    return sorted(zip((names[code] for code in routes.tolist()), prices.tolist(), departures.tolist()))
+
+
+@pytest.mark.parametrize('since', [None, SINCE])
+def test_baseline_weights(histories, since):
+    full, delta = histories
+    assert baseline_rows(delta, since) == baseline_rows(full, since)
+
+
+def dataset_columns(items):
+    """Items as the columns export.read_columns loads."""
+    def dates(name, key=lambda value: value):
+        return np.array(
+            [baseline.iso_date(key(item[name])) if name in item else 'NaT' for item in items], dtype='datetime64[D]'
+        )
+
+    return {
+        'flight_id': np.array([item['FlightID'] for item in items]),
+        'price': np.array([float(item['price']) for item in items]),
+        'departure_date': dates('departure_date'),
+        'return_date': dates('return_date'),
+        'collection_date': dates('SortKey', lambda sort_key: sort_key[4:]),
+        'previous_date': dates('previous_cid', lambda sort_key: sort_key[4:]),
+    }
+
+
+def test_backtest_routes(histories):
+    full, delta = histories
+    expected = backtest.Routes(dataset_columns(full))
+    routes = backtest.Routes(dataset_columns(delta))
+    for name in ('flight_ids', 'prices', 'dates', 'departures', 'returns', 'starts', 'counts'):
+        assert np.array_equal(getattr(routes, name), getattr(expected, name)), name
+    assert not expected.carried.any()
+    assert routes.carried.sum() == len(full) - len(delta)
+
+
+@pytest.mark.parametrize('history_days', [0, 20])
+def test_backtest_levels_match_a_per_record_check(histories, history_days):
+    _, delta = histories
+    routes = backtest.Routes(dataset_columns(delta))
+    grid = [{'percentiles': [1, 5], 'limit': 15, 'history_days': history_days},
+            {'percentiles': [10, 25, 50], 'limit': 5, 'history_days': history_days}]
+    levels, _, _ = backtest.backtest(routes, grid)
+    for i, params in enumerate(grid):
+        expected = np.zeros(len(routes), dtype=np.int8)
+        for start, count in zip(routes.starts.tolist(), routes.counts.tolist()):
+            for row in range(start, start + count):
+                window = [
+                    routes.prices[k] for k in range(start, row + 1)
+                    if not history_days or routes.dates[k] >= routes.dates[row] - history_days
+                ]
+                if routes.carried[row] or len(window) < params['limit']:
+                    continue
+                thresholds = stats.percentile(window, params['percentiles'])
+                for threshold, level in zip(thresholds, backtest.levels_for(params['percentiles'])):
+                    if routes.prices[row] < threshold:
+                        expected[row] = level
+                        break
+        assert np.array_equal(levels[i], expected), params
+        assert expected.any()
+
+
+def test_capped_days_agree(histories, monkeypatch):
+    monkeypatch.setattr(snapshots, 'MAX_CARRIED_DAYS', 2)
+    _, delta = histories
+    weighted = defaultdict(int)
+    for flight_id, _, _ in baseline_rows(delta):
+        weighted[flight_id] += 1
+    for flight_id, items in by_route(delta).items():
+        prices = snapshots.daily_prices(items)
+        assert len(prices) == weighted[flight_id] <= 3 * len(items), flight_id
+
+
+class ScanTable:
+    """Serves the baseline job's reads from a list of items."""
+
+    def __init__(self, items, since=None):
+        self.items = {(item['FlightID'], item['SortKey']): item for item in items}
+        self.since = since
+
+    def scan_items(self, segments, projection, filter_expression):
+        # what the job's filter lets through: the window's snapshots and details items
+        for (_, sort_key), item in self.items.items():
+            if sort_key == 'details' or sort_key >= f"cid_{self.since or ''}":
+                yield {name: item[name] for name in projection if name in item}
+
+    def batch_get_items(self, keys, projection):
+        for key in keys:
+            item = self.items[key['FlightID'], key['SortKey']]
+            yield {name: item[name] for name in projection if name in item}
+
+
+def details_items(delta):
+    """Details items of delta-written routes, remembering their last snapshots."""
+    last = {}
+    for item in sorted(delta, key=lambda item: item['SortKey']):
+        last[item['FlightID']] = dict(item, cid=item['SortKey'])
+    return [
+        {
+            'FlightID': flight_id, 'SortKey': 'details',
+            'last_snapshot': {name: snapshot[name] for name in snapshots.LAST_SNAPSHOT_FIELDS if name in snapshot}
+        }
+        for flight_id, snapshot in last.items()
+    ]
+
+
+def job_baselines(items, since, until):
+    table = ScanTable(items, since)
+    columns = baseline_job.scan_prices(table, since=since, until=until)
+    return sorted(
+        (item['FlightID'], item['SortKey'], item['count'], item['median'], item['percentiles'])
+        for item in baseline_job.baseline_items(columns, until)
+    )
+
+
+@pytest.mark.parametrize('since', [None, '20260915'])
+def test_baseline_of_a_route_stable_up_to_today(since):
+    # 100 days at 500, then 30 unchanged days at 400
+    full, delta = [], []
+    for day in range(130):
+        item = {
+            'FlightID': 'KTW-AAA-BREAK', 'SortKey': f'cid_{dt.date(2026, 6, 1) + dt.timedelta(days=day):%Y%m%d}',
+            'price': 500 if day < 100 else 400, 'departure_date': '20261201', 'return_date': '20261205'
+        }
+        full.append(item)
+        if day == 0:
+            delta.append(item)
+        elif day == 100:
+            delta.append(dict(item, previous_cid=delta[0]['SortKey'], previous_price=500))
+    until = full[-1]['SortKey'][4:]
+    expected = job_baselines(full, since, until)
+    assert job_baselines(delta + details_items(delta), since, until) == expected
+    if since is None:
+        assert expected[0][2] == 130
+        assert expected[0][4] == {'1': 400, '5': 400}
+
+
+@pytest.mark.parametrize('since', [None, SINCE])
+def test_baselines_of_routes_left_unchanged(stable_histories, since):
+    full, delta = stable_histories
+    until = max(item['SortKey'] for item in full)[4:]
+    assert job_baselines(delta + details_items(delta), since, until) == job_baselines(full, since, until)
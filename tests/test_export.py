@@ -0,0 +1,44 @@
+import gzip
+import importlib
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'analytics'))
+export = importlib.import_module('export')
+
+
+def write_export(directory, dates):
+    directory.mkdir(parents=True, exist_ok=True)
+    with gzip.open(directory / '0000.json.gz', 'wt') as file:
+        for date in dates:
+            image = {
+                'FlightID': {'S': 'KTW-AAA-BREAK'}, 'SortKey': {'S': f'cid_{date}'}, 'price': {'N': '100'},
+                'departure_date': {'S': '20261101'}, 'return_date': {'S': '20261105'}, 'days': {'N': '4'},
+            }
+            file.write(json.dumps({'Item': image}) + '\n')
+    return directory
+
+
+def run_export(monkeypatch, out, source, *args):
+    monkeypatch.setattr(sys, 'argv', ['export.py', str(out), '--from-export', str(source), '--format', 'npz', *args])
+    export.main()
+
+
+def exported_dates(out):
+    return sorted(str(date) for date in set(export.read_columns(out)['collection_date']))
+
+
+def test_incremental_run_keeps_dates_missing_from_the_source(tmp_path, monkeypatch):
+    out = tmp_path / 'dataset'
+    run_export(monkeypatch, out, write_export(tmp_path / 'first', ['20261017', '20261018']))
+    run_export(monkeypatch, out, write_export(tmp_path / 'second', ['20261017']))
+    assert exported_dates(out) == ['2026-10-17', '2026-10-18']
+
+
+def test_repeated_runs_replace_the_last_date(tmp_path, monkeypatch):
+    out = tmp_path / 'dataset'
+    source = write_export(tmp_path / 'source', ['20261017', '20261018'])
+    for args in [(), (), ('--full',)]:
+        run_export(monkeypatch, out, source, *args)
+        assert len(export.read_columns(out)['price']) == 2
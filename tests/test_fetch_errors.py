@@ -0,0 +1,54 @@
+import importlib
+import io
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+download = importlib.import_module('flights-download.lambda_function')
+fetch = importlib.import_module('flights-download.fetch')
+
+
+class BodyAdapter(BaseAdapter):
+    """Answers every request with the same status and body."""
+
+    def __init__(self, status_code, body):
+        super().__init__()
+        self.status_code = status_code
+        self.body = body
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.status_code = self.status_code
+        response.raw = io.BytesIO(self.body)
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def kayak(monkeypatch):
+    def serve(status_code, body):
+        session = requests.Session()
+        session.mount('https://', BodyAdapter(status_code, body))
+        monkeypatch.setattr(fetch, 'SESSION', session)
+
+    monkeypatch.setattr(fetch, 'get_response_cache', lambda: None)
+    return serve
+
+
+@pytest.mark.parametrize('stream, status_code, body', [
+    (False, 200, b'<html>captcha</html>'),
+    (True, 200, b'<html>captcha</html>'),
+    (False, 503, b'{"destinations": []}'),
+    (True, 503, b'{"destinations": []}'),
+    (False, 200, b'{"error": "blocked"}'),
+])
+def test_bad_responses_fail_the_origin_only(kayak, stream, status_code, body):
+    kayak(status_code, body)
+    result = download.process_origin('KTW', None, None, None, budget=5, stream=stream)
+    assert result['status'] == 'error'
+    assert result['written'] == 0
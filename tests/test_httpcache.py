@@ -0,0 +1,16 @@
+import datetime as dt
+import importlib
+
+httpcache = importlib.import_module('flights-download.httpcache')
+
+
+def timestamp(*args):
+    return dt.datetime(*args).timestamp()
+
+
+def test_entries_of_a_previous_day_are_not_fresh(tmp_path):
+    now = timestamp(2026, 10, 18, 0, 30)
+    cache = httpcache.ResponseCache(tmp_path, ttl=6 * 3600, clock=lambda: now)
+    assert cache.is_fresh({'fetched_at': timestamp(2026, 10, 18, 0, 5)})
+    assert not cache.is_fresh({'fetched_at': timestamp(2026, 10, 17, 23, 55)})
+    assert not cache.is_fresh({'fetched_at': now - 6 * 3600})
@@ -0,0 +1,89 @@
+import importlib
+import io
+import threading
+import time
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+download = importlib.import_module('flights-download.lambda_function')
+fetch = importlib.import_module('flights-download.fetch')
+
+
+class SlowAdapter(BaseAdapter):
+    """Answers every request with no destinations after latency seconds, counting requests in flight."""
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.in_flight = self.max_in_flight = 0
+
+    def send(self, request, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.status_code = 200
+        response.raw = io.BytesIO(b'{"destinations": []}')
+        return response
+
+    def close(self):
+        pass
+
+
+class Airports:
+    def add_destinations(self, destinations):
+        pass
+
+    def save_routes(self):
+        pass
+
+
+class Context:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def get_remaining_time_in_millis(self):
+        return self.seconds * 1000
+
+
+@pytest.fixture
+def kayak(monkeypatch):
+    def serve(latency):
+        adapter = SlowAdapter(latency)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        monkeypatch.setattr(fetch, 'SESSION', session)
+        return adapter
+
+    monkeypatch.setattr(fetch, 'get_response_cache', lambda: None)
+    monkeypatch.setattr(download, 'get_response_cache', lambda: None)
+    monkeypatch.setattr(download, 'get_airport_cache', Airports)
+    monkeypatch.setattr(download, 'get_table', object)
+    return serve
+
+
+def test_queued_origins_share_the_invocation_deadline(kayak):
+    kayak(0.8)
+    # 1 s before the writes' reserve, while each origin alone could take 120 s;
+    # one origin at a time takes 2.4 s
+    event = {'origins': ['KTW', 'KRK', 'WAW'], 'max_concurrency': 3}
+    start = time.monotonic()
+    download.lambda_handler(event, Context(16))
+    assert time.monotonic() - start < 1.4
+
+
+@pytest.mark.parametrize('max_concurrency', [1, 2, 3, 8])
+def test_requests_in_flight_stay_within_max_concurrency(kayak, max_concurrency):
+    adapter = kayak(0.05)
+    download.lambda_handler({'origins': ['KTW', 'KRK', 'WAW'], 'max_concurrency': max_concurrency}, None)
+    assert adapter.max_in_flight <= max_concurrency
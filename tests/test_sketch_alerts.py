@@ -0,0 +1,33 @@
+import importlib
+
+stream = importlib.import_module('flights-updateOnStream.lambda_function')
+sketch = importlib.import_module('flights-updateOnStream.sketch')
+
+
+def record(price):
+    return {'dynamodb': {'NewImage': {
+        'price': {'N': str(price)}, 'days': {'N': '4'},
+        'departure_date': {'S': '20261101'}, 'return_date': {'S': '20261105'}
+    }}}
+
+
+def sketch_stats(prices):
+    price_sketch = sketch.PriceSketch()
+    for price in prices:
+        price_sketch.add(price)
+    median_price, *thresholds = price_sketch.percentile([50] + stream.PERCENTILES)
+    return price_sketch.count, median_price, thresholds, {}
+
+
+def test_constant_history_never_alerts(monkeypatch):
+    monkeypatch.setattr(stream, 'STATS_MODE', 'sketch')
+    for price in range(100, 5000):
+        stats = sketch_stats([price] * 2 * stream.PRICE_NUMBER_LIMIT)
+        assert stream.check_flight(None, 'KTW-AAA-BREAK', record(price), stats) is None, price
+
+
+def test_price_in_a_lower_bucket_alerts(monkeypatch):
+    monkeypatch.setattr(stream, 'STATS_MODE', 'sketch')
+    stats = sketch_stats([1000] * 2 * stream.PRICE_NUMBER_LIMIT)
+    cheap = stream.check_flight(None, 'KTW-AAA-BREAK', record(900), stats)
+    assert cheap is not None and cheap['level'] == stream.LEVELS[0]
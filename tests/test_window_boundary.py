@@ -0,0 +1,46 @@
+import importlib
+
+from flights_common.snapshots import daily_prices
+
+baseline = importlib.import_module('flights-baseline.baseline')
+
+FLIGHT_ID = 'KTW-AAA-BREAK'
+# day 1 before the window, days 10 and 12 delta-written inside it
+BEFORE = {'FlightID': FLIGHT_ID, 'SortKey': 'cid_20261001', 'price': 100, 'departure_date': '20261101'}
+IN_WINDOW = [
+    {
+        'FlightID': FLIGHT_ID, 'SortKey': 'cid_20261010', 'price': 200, 'departure_date': '20261201',
+        'previous_cid': 'cid_20261001', 'previous_price': 100
+    },
+    {
+        'FlightID': FLIGHT_ID, 'SortKey': 'cid_20261012', 'price': 150, 'departure_date': '20261201',
+        'previous_cid': 'cid_20261010', 'previous_price': 200
+    },
+]
+
+
+def baseline_prices(items, since):
+    columns = baseline.PriceColumns(since)
+    for item in items:
+        columns.add(item)
+    return sorted(columns.arrays()[1].tolist())
+
+
+def test_window_start_counts_the_same_days():
+    since = '20261005'
+    expected = sorted([100.0] * 5 + [200.0] * 2 + [150.0])
+    assert sorted(daily_prices(IN_WINDOW, since)) == expected
+    assert baseline_prices(IN_WINDOW + [BEFORE], since) == expected
+
+
+def test_previous_keys_reach_before_the_window():
+    columns = baseline.PriceColumns('20261005')
+    for item in IN_WINDOW:
+        columns.add(item)
+    assert columns.previous_keys() == [{'FlightID': FLIGHT_ID, 'SortKey': 'cid_20261001'}]
+
+
+def test_without_window_every_day_counts():
+    expected = sorted([100.0] * 9 + [200.0] * 2 + [150.0])
+    assert sorted(daily_prices([BEFORE] + IN_WINDOW)) == expected
+    assert baseline_prices([BEFORE] + IN_WINDOW, None) == expected